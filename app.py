@@ -1,14 +1,25 @@
-from abc import abstractmethod
-
-from PySide6 import QtGui
-from PySide6.QtWidgets import QApplication, QWidget, QTabWidget, QVBoxLayout, QFileDialog, QMessageBox, QPushButton
-from filetab import FileTab
-from settingdata import settingData
-from settingtab import SettingsTab
 import sys
 import os
-import configparser
-from readwindow import ReadWindow, get_most_recent_file
+
+# 最先导入，作为启动耗时的起点
+import perf
+
+with perf.span('import_qt'):
+    from PySide6 import QtGui
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication, QWidget, QTabWidget, QVBoxLayout, QMessageBox, QPushButton
+with perf.span('import_tabs'):
+    from filetab import FileTab
+    from settingdata import settingData
+    from settingtab import SettingsTab
+    from history import get_most_recent_file, historyStore
+
+
+def _load_read_window():
+    """阅读窗口依赖较多，第一次打开书时才导入"""
+    with perf.span('import_readwindow'):
+        import readwindow
+    return readwindow
 
 
 class MyWindow(QWidget):
@@ -18,7 +29,6 @@ class MyWindow(QWidget):
 
         try:
             settingData.readData()
-            print(settingData)
         except Exception as e:
             print(e)
 
@@ -37,35 +47,33 @@ class MyWindow(QWidget):
 
         # 创建主布局
         layout = QVBoxLayout(self)
-        
-        # 添加"打开上次阅读的文件"按钮
+
+        # 添加"打开上次阅读的文件"按钮，窗口显示后再检查文件是否存在
         self.lastFileButton = QPushButton("打开上次阅读的文件")
+        self.lastFileButton.setEnabled(False)
         self.lastFileButton.clicked.connect(self.openLastFile)
-        
-        # 检查是否有上次阅读的文件
-        last_file = self.getLastFile()
-        if last_file and os.path.exists(last_file):
-            self.lastFileButton.setText(f"打开上次阅读的文件: {os.path.basename(last_file)}")
-            self.lastFileButton.setToolTip(last_file)
-        else:
-            self.lastFileButton.setEnabled(False)
-            self.lastFileButton.setText("没有找到上次阅读的文件")
-        
+
         # 添加"打开历史记录"按钮
         self.historyButton = QPushButton("查看阅读历史")
+        self.historyButton.setEnabled(False)
         self.historyButton.clicked.connect(self.openHistoryFile)
-        
-        # 检查是否有历史记录
-        if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")):
-            self.historyButton.setEnabled(False)
-        
+
+        # 添加"搜索书库"按钮
+        self.libraryButton = QPushButton("搜索书库")
+        self.libraryButton.clicked.connect(self.openLibrarySearch)
+        self.librarySearch = None
+
         # 添加按钮到布局
         layout.addWidget(self.lastFileButton)
         layout.addWidget(self.historyButton)
+        layout.addWidget(self.libraryButton)
         layout.addWidget(self.tabWidget)
         layout.setContentsMargins(10, 10, 10, 10)
         layout.setSpacing(10)
 
+        # 文件检查和读取历史记录不影响窗口显示，放到事件循环开始后进行
+        QTimer.singleShot(0, self.checkFiles)
+
     def initUI(self):
         self.setWindowTitle('阅读器')
         # 设置总体程序大小默认300 * 200
@@ -79,37 +87,38 @@ class MyWindow(QWidget):
         self.move(int((screen.width() - size.width()) / 2), int((screen.height() - size.height()) / 2))
 
     def closeEvent(self, event):
-        settingData.writeData()
+        # 退出前会写入尚未写入的设置
+        settingData.scheduleWrite()
         event.accept()
-    
+
+    def checkFiles(self):
+        """检查上次阅读的文件和历史记录，更新按钮状态"""
+        with perf.span('startup_checks'):
+            last_file = self.getLastFile()
+            if last_file:
+                self.lastFileButton.setEnabled(True)
+                self.lastFileButton.setText(f"打开上次阅读的文件: {os.path.basename(last_file)}")
+                self.lastFileButton.setToolTip(last_file)
+            else:
+                self.lastFileButton.setText("没有找到上次阅读的文件")
+            # 检查是否有历史记录
+            self.historyButton.setEnabled(bool(historyStore.items()))
+        perf.milestone('startup_ready')
+
     def getLastFile(self):
         """获取上次阅读的文件路径"""
-        # 首先尝试从settingData获取
+        # 首先尝试从已读取的设置获取
         if settingData.filePath and os.path.exists(settingData.filePath):
             return settingData.filePath
-        
-        # 然后尝试从settings.ini直接读取
-        try:
-            config = configparser.ConfigParser()
-            settings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.ini")
-            
-            if os.path.exists(settings_path):
-                config.read(settings_path, encoding='utf-8')
-                if 'file' in config and 'filepath' in config['file']:
-                    file_path = config['file']['filepath']
-                    if os.path.exists(file_path):
-                        return file_path
-        except Exception:
-            pass
-        
-        # 最后尝试从历史记录获取
+
+        # 然后尝试从历史记录获取
         try:
             return get_most_recent_file()
         except Exception:
             pass
-        
+
         return None
-    
+
     def openLastFile(self):
         """打开上次阅读的文件"""
         file_path = self.lastFileButton.toolTip()
@@ -117,20 +126,27 @@ class MyWindow(QWidget):
             self.openReadWindow(file_path)
         else:
             QMessageBox.warning(self, "错误", "无法打开上次阅读的文件，文件可能已被移动或删除。")
-    
+
     def openHistoryFile(self):
         """打开历史记录窗口"""
         # 创建一个临时的ReadWindow来显示历史记录
         try:
-            temp_window = ReadWindow(self.getLastFile())
+            temp_window = _load_read_window().ReadWindow(self.getLastFile())
             temp_window.displayHistory()
         except Exception as e:
             QMessageBox.warning(self, "错误", f"无法打开历史记录: {str(e)}")
-    
+
+    def openLibrarySearch(self):
+        """打开书库搜索窗口"""
+        if self.librarySearch is None:
+            self.librarySearch = _load_read_window().LibrarySearchMenu()
+        self.librarySearch.show()
+        self.librarySearch.activateWindow()
+
     def openReadWindow(self, file_path):
         """打开阅读窗口"""
         try:
-            self.read_window = ReadWindow(file_path)
+            self.read_window = _load_read_window().ReadWindow(file_path)
             self.read_window.show()
             # 隐藏选择窗口
             self.hide()
@@ -139,14 +155,33 @@ class MyWindow(QWidget):
 
 
 def main():
+    # --startup-report 在窗口显示后输出启动耗时并退出，--startup-budget 毫秒数超出时返回非零退出码
+    report = '--startup-report' in sys.argv
+    budget = None
+    if '--startup-budget' in sys.argv:
+        budget = float(sys.argv[sys.argv.index('--startup-budget') + 1])
+        report = True
     app = QApplication(sys.argv)
-    
+    perf.milestone('startup_app')
+
     # 创建并显示主窗口
     window = MyWindow()
     window.show()
-    
+    perf.milestone('startup_shown')
+
+    if report:
+        # 排在 checkFiles 之后，启动检查完成后退出
+        QTimer.singleShot(0, app.quit)
+
     # 运行应用程序
-    return app.exec()
+    result = app.exec()
+    if report:
+        elapsed = perf.summary().get('startup_ready', {}).get('max', 0.0)
+        print(f"启动耗时 {elapsed:.1f} ms")
+        if budget is not None and elapsed > budget:
+            print(f"超出启动预算 {budget:.0f} ms")
+            return 1
+    return result
 
 if __name__ == "__main__":
     sys.exit(main())
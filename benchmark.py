@@ -0,0 +1,241 @@
+"""排版引擎基准测试
+
+生成固定内容的中文小说样本，分别计时读取解码、分页、排版、翻页、章节扫描和章节跳转，
+结果保存为 JSON，并可与之前保存的基线比较。
+
+    python benchmark.py --sizes 1,10 --output result.json
+    python benchmark.py --baseline result.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from bookcache import newline_width
+from chapters import scan_chapters, with_byte_offsets
+from filecache import ContentCache
+from pageindex import PageIndex
+from textcodec import detect_encoding
+from textlayout import TextLayout
+
+# 样本目录，与缓存一样放在程序目录下
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_data")
+
+ENCODINGS = ['utf-8', 'gbk', 'big5']
+# normal: LF 换行；crlf: CRLF 换行；single: 整本书只有一行
+VARIANTS = ['normal', 'crlf', 'single']
+SIZES = [1, 10, 100]
+
+# 样本用字，只包含 GBK 和 Big5 都能编码的常用字
+_CHARS = ('的一是不了在人有我他這個們中來上大為和國地到以說時要就出會可也你對生能而子那得於著下自之年過發'
+          '後作裡用道行所然家種事成方多經麼去法學如都同現當沒動面起看定天分還進好小部其些主樣理心她本前開'
+          '但因只從想實日軍者意無力它與長把機十民第公此已工使情明性知全三又關點正業外將兩高間由問很最重並')
+_PUNCTUATION = '，，，。。！？、：；'
+_NUMERALS = '一二三四五六七八九十百千'
+
+# 排版参数，与默认设置相近
+LINE_SIZE = 20
+TEXT_LINE = 10
+# 排版、翻页和章节跳转各取样的页数
+SAMPLE_PAGES = 1000
+
+
+def _chinese_number(n: int) -> str:
+    """将章节序号写成中文数字，一万以上直接使用阿拉伯数字"""
+    if n >= 10000:
+        return str(n)
+    digits = '零一二三四五六七八九'
+    units = ['千', '百', '十', '']
+    result = ''
+    for d, unit in zip(f"{n:04d}", units):
+        if d != '0':
+            result += digits[int(d)] + unit
+        elif result and not result.endswith('零'):
+            result += '零'
+    result = result.rstrip('零')
+    # 十到十九习惯写作"十X"
+    return result[1:] if result.startswith('一十') else result
+
+
+def _paragraph(rng: random.Random) -> str:
+    sentences = []
+    for _ in range(rng.randint(1, 6)):
+        sentences.append(''.join(rng.choice(_CHARS) for _ in range(rng.randint(4, 30))))
+        sentences.append(rng.choice(_PUNCTUATION))
+    return '　　' + ''.join(sentences)
+
+
+def generate_novel(path: str, size_mb: int, encoding: str, variant: str, seed: int = 20240601) -> None:
+    """生成确定内容的样本小说
+
+    先用固定种子生成一批段落，再按固定顺序拼接到目标大小，包含章节标题、连续空行，
+    single 变体去掉所有换行，成为只有一行的病态文件。
+
+    Args:
+        path: 输出路径
+        size_mb: 目标大小（MB），按编码后的字节数计算
+        encoding: 文件编码
+        variant: normal、crlf 或 single
+        seed: 随机种子
+    """
+    rng = random.Random(seed)
+    pool = [_paragraph(rng) for _ in range(2000)]
+    newline = {'normal': '\n', 'crlf': '\r\n', 'single': ''}[variant]
+    target = size_mb * 1024 * 1024
+    written = 0
+    chapter = 0
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        while written < target:
+            chapter += 1
+            lines = [f"第{_chinese_number(chapter)}章 {''.join(rng.choice(_CHARS) for _ in range(rng.randint(2, 8)))}"]
+            for _ in range(rng.randint(20, 80)):
+                lines.append(pool[rng.randrange(len(pool))])
+                if rng.random() < 0.05:
+                    # 连续的空行
+                    lines.extend([''] * rng.randint(1, 5))
+            data = (newline.join(lines) + newline).encode(encoding)
+            f.write(data)
+            written += len(data)
+    os.replace(tmp, path)
+
+
+def sample_path(size_mb: int, encoding: str, variant: str) -> str:
+    return os.path.join(DATA_DIR, f"novel_{size_mb}mb_{encoding}_{variant}.txt")
+
+
+def _time(func: Callable[[], object], repeat: int) -> float:
+    """重复执行并返回最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_case(path: str, repeat: int) -> Dict[str, float]:
+    """对一个样本计时各个引擎阶段"""
+    results = {}
+    results['detect'] = _time(lambda: detect_encoding(path), repeat)
+    # 每次使用新的内容缓存，计时冷启动读取
+    results['read'] = _time(lambda: ContentCache().load(path), repeat)
+    entry = ContentCache().load(path)
+    text, encoding = entry.text, entry.encoding
+
+    layout = TextLayout(LINE_SIZE, TEXT_LINE)
+
+    def paginate():
+        index = PageIndex(lambda mark: layout.next_mark(text, mark), len(text))
+        index.build()
+        return index
+
+    results['paginate'] = _time(paginate, repeat)
+    index = paginate()
+    rng = random.Random(1)
+    pages = [rng.randrange(index.page_count) for _ in range(SAMPLE_PAGES)] if index.page_count else []
+
+    # 对应 subText：从任意页起始位置排版并生成页面文本
+    marks = [index.offsets[page] for page in pages]
+    results['render'] = _time(lambda: [layout.render(text, mark) for mark in marks], repeat)
+    # 对应 rollPage：按页码查索引再排版
+    results['roll_page'] = _time(lambda: [layout.render(text, index.offset(page)) for page in pages], repeat)
+
+    # 对应 getChapter：扫描章节并换算字节偏移
+    width = newline_width(path, encoding)
+    results['chapters'] = _time(lambda: with_byte_offsets(text, scan_chapters(text), encoding, width), repeat)
+    chapters = scan_chapters(text)
+
+    # 对应 jumpToChapter：定位章节所在的页并排版
+    targets = [chapters[rng.randrange(len(chapters))] for _ in range(SAMPLE_PAGES)] if chapters else []
+    results['jump_chapter'] = _time(
+        lambda: [layout.render(text, index.offsets[index.page_of(chapter.offset)]) for chapter in targets], repeat)
+
+    results['pages'] = index.page_count
+    results['chapter_count'] = len(chapters)
+    if hasattr(text, 'close'):
+        text.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """与基线比较，返回变慢超过 threshold 比例的项目"""
+    regressions = []
+    for case, stages in results.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        for stage, seconds in stages.items():
+            if stage in ('pages', 'chapter_count') or stage not in base:
+                continue
+            old = base[stage]
+            # 过短的计时误差太大，不参与比较
+            if old < 0.001:
+                continue
+            ratio = seconds / old
+            line = f"{case} {stage}: {old * 1000:.2f} ms -> {seconds * 1000:.2f} ms ({ratio:.2f}x)"
+            print(line)
+            if ratio > 1 + threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="排版引擎基准测试")
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help="样本大小（MB），逗号分隔")
+    parser.add_argument('--encodings', default=','.join(ENCODINGS), help="样本编码，逗号分隔")
+    parser.add_argument('--variants', default=','.join(VARIANTS), help="样本类型，逗号分隔")
+    parser.add_argument('--repeat', type=int, default=3, help="每个阶段重复次数，取最短耗时")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果输出路径")
+    parser.add_argument('--baseline', help="与之比较的基线结果")
+    parser.add_argument('--threshold', type=float, default=0.2, help="判定变慢的比例")
+    args = parser.parse_args(argv)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    results = {}
+    for size in (int(value) for value in args.sizes.split(',')):
+        for encoding in args.encodings.split(','):
+            for variant in args.variants.split(','):
+                path = sample_path(size, encoding, variant)
+                if not os.path.exists(path):
+                    print(f"生成样本 {path}")
+                    generate_novel(path, size, encoding, variant)
+                case = f"{size}mb-{encoding}-{variant}"
+                results[case] = run_case(path, args.repeat)
+                stages = ', '.join(f"{stage} {value * 1000:.1f} ms" for stage, value in results[case].items()
+                                   if stage not in ('pages', 'chapter_count'))
+                print(f"{case}: {stages}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'line_size': LINE_SIZE,
+                'text_line': TEXT_LINE,
+            },
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项比基线慢 {args.threshold:.0%} 以上:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,452 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from array import array
+from typing import Optional
+
+import perf
+from chapters import Chapter, CHAPTER_PATTERN_VERSION, scan_chapters, with_byte_offsets
+from pageindex import PageIndex
+from textcodec import NORMALIZE_VERSION
+
+# 缓存目录，与 history.json 一样放在程序目录下
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+# 预索引工具建立的条目放在子目录中，不参与缓存目录按大小的淘汰，由预索引工具按单独的预算管理
+INDEXED_DIR = os.path.join(CACHE_DIR, "indexed")
+
+# 计算指纹时在文件头、中、尾各采样的字节数
+SAMPLE_SIZE = 64 * 1024
+
+_MAGIC = b'RDPG'
+_HEADER = struct.Struct('<4sI')
+
+
+def file_fingerprint(path: str) -> str:
+    """计算文件内容指纹
+
+    小文件对全部内容计算摘要，大文件只采样头、中、尾三段，避免读取整个文件
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        十六进制指纹字符串
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * 3:
+            digest.update(f.read())
+        else:
+            for start in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+                f.seek(start)
+                digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def evict_cache_dir(cache_dir: str, max_bytes: int) -> int:
+    """缓存目录超出大小限制时，删除最久未使用的条目
+
+    只统计目录下的文件，子目录中的条目不受影响
+
+    Returns:
+        删除的条目数
+    """
+    try:
+        entries = []
+        with os.scandir(cache_dir) as it:
+            for item in it:
+                if item.is_file():
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+    except OSError:
+        return 0
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def _report_eviction(cache_dir: str, max_bytes: int) -> None:
+    removed = evict_cache_dir(cache_dir, max_bytes)
+    if removed:
+        print(f"缓存超出 {max_bytes // (1024 * 1024)} MB，删除了 {removed} 个最久未使用的条目")
+
+
+def _sample_digest(path: str, start: int, size: int) -> str:
+    """计算文件中 [start, start + size) 字节的摘要"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.blake2b(f.read(size), digest_size=16).hexdigest()
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    """先写入临时文件再替换，避免写入中断留下损坏的缓存"""
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tempPath, path)
+    except OSError:
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        raise
+
+
+class PageCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = 64 * 1024 * 1024,
+                 indexed_dir: str = INDEXED_DIR):
+        """分页索引的磁盘缓存
+
+        每个条目以文件指纹、排版参数和规范化版本为键，条目内记录文件的修改时间和大小，
+        打开时校验不一致即视为过期并删除。缓存目录总大小超过 max_bytes 时按最近使用时间淘汰。
+        预索引工具建立的条目保存在 indexed_dir 中，不参与淘汰，查找时优先使用。
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存目录的最大总字节数
+            indexed_dir: 预建条目的目录
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.indexed_dir = indexed_dir
+
+    def entry_path(self, fingerprint: str, layout_key: str, indexed: bool = False) -> str:
+        """获取缓存条目的文件路径"""
+        key = f"{fingerprint}|{layout_key}|{NORMALIZE_VERSION}"
+        name = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.indexed_dir if indexed else self.cache_dir, f"{name}.pages")
+
+    def find_entry(self, fingerprint: str, layout_key: str) -> str:
+        """获取已有条目的路径，有预建条目时返回预建条目"""
+        indexed = self.entry_path(fingerprint, layout_key, True)
+        return indexed if os.path.exists(indexed) else self.entry_path(fingerprint, layout_key)
+
+    def load(self, file_path: str, fingerprint: str, layout_key: str, page_index: PageIndex) -> bool:
+        """从缓存恢复分页索引
+
+        Returns:
+            是否命中有效缓存
+        """
+        entry = self.find_entry(fingerprint, layout_key)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+
+        try:
+            magic, headerSize = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError("bad magic")
+            start = _HEADER.size
+            header = json.loads(data[start:start + headerSize].decode('utf-8'))
+            offsets = array('q')
+            offsets.frombytes(data[start + headerSize:])
+            valid = (header['fingerprint'] == fingerprint
+                     and header['layout'] == layout_key
+                     and header['normalize'] == NORMALIZE_VERSION
+                     and header['mtime'] == stat.st_mtime_ns
+                     and header['size'] == stat.st_size
+                     and header['length'] == page_index.length
+                     and header['count'] == len(offsets))
+        except (ValueError, KeyError, struct.error, UnicodeDecodeError):
+            valid = False
+
+        if not valid:
+            # 过期或损坏的条目直接删除，由调用方重新分页
+            self.remove(entry)
+            return False
+
+        page_index.restore(offsets, header['frontier'], header['complete'])
+        # 更新访问时间，用于淘汰
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def is_complete(self, file_path: str, fingerprint: str, layout_key: str) -> bool:
+        """只读取条目头部，判断是否已有完整且有效的分页索引"""
+        try:
+            with open(self.find_entry(fingerprint, layout_key), 'rb') as f:
+                magic, headerSize = _HEADER.unpack(f.read(_HEADER.size))
+                header = json.loads(f.read(headerSize).decode('utf-8'))
+            stat = os.stat(file_path)
+            return (magic == _MAGIC
+                    and header['fingerprint'] == fingerprint
+                    and header['layout'] == layout_key
+                    and header['normalize'] == NORMALIZE_VERSION
+                    and header['mtime'] == stat.st_mtime_ns
+                    and header['size'] == stat.st_size
+                    and header['complete'])
+        except (OSError, ValueError, KeyError, struct.error, UnicodeDecodeError):
+            return False
+
+    def save(self, file_path: str, fingerprint: str, layout_key: str, page_index: PageIndex,
+             indexed: bool = False) -> None:
+        """保存分页索引，未完成的索引也会保存，下次打开时从中断处继续
+
+        indexed 为 True 或已有预建条目时保存为预建条目，不触发淘汰
+        """
+        with page_index.lock:
+            offsets = page_index.offsets.tobytes()
+            count = len(page_index.offsets)
+            frontier = page_index.frontier
+            complete = page_index.complete
+        if count == 0:
+            return
+        try:
+            stat = os.stat(file_path)
+            header = json.dumps({
+                'fingerprint': fingerprint,
+                'layout': layout_key,
+                'normalize': NORMALIZE_VERSION,
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'length': page_index.length,
+                'count': count,
+                'frontier': frontier,
+                'complete': complete,
+            }).encode('utf-8')
+            entry = self.entry_path(fingerprint, layout_key, True)
+            indexed = indexed or os.path.exists(entry)
+            if not indexed:
+                entry = self.entry_path(fingerprint, layout_key)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            _atomic_write(entry, _HEADER.pack(_MAGIC, len(header)) + header + offsets)
+        except OSError as e:
+            print(f"保存分页缓存失败: {e}")
+            return
+        if not indexed:
+            self.evict()
+
+    def remove(self, entry: str) -> None:
+        _remove(entry)
+
+    def evict(self) -> None:
+        _report_eviction(self.cache_dir, self.max_bytes)
+
+
+class TocCache:
+    # 判断文件是否只是在末尾追加内容时比对的头尾字节数
+    EDGE_SIZE = 4096
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = 64 * 1024 * 1024,
+                 indexed_dir: str = INDEXED_DIR):
+        """章节目录的磁盘缓存，每本书一个条目
+
+        条目以文件路径为键，内部记录文件指纹和章节规则版本。指纹一致直接使用；
+        文件只在末尾追加了内容时，从最后一个已知章节处继续扫描，不再重扫全书。
+
+        Args:
+            cache_dir: 缓存目录，与分页缓存共用
+            max_bytes: 缓存目录的最大总字节数
+            indexed_dir: 预建条目的目录，不参与淘汰
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.indexed_dir = indexed_dir
+
+    def entry_path(self, file_path: str, indexed: bool = False) -> str:
+        """获取书籍目录缓存的文件路径"""
+        name = hashlib.blake2b(os.path.abspath(file_path).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.indexed_dir if indexed else self.cache_dir, f"{name}.toc")
+
+    def find_entry(self, file_path: str) -> str:
+        """获取已有条目的路径，有预建条目时返回预建条目"""
+        indexed = self.entry_path(file_path, True)
+        return indexed if os.path.exists(indexed) else self.entry_path(file_path)
+
+    def get_chapters(self, file_path: str, fingerprint: str, text: str, encoding: str,
+                     indexed: bool = False) -> list:
+        """获取书籍的章节列表，优先使用缓存
+
+        Args:
+            file_path: 文件路径
+            fingerprint: 文件内容指纹
+            text: 全文
+            encoding: 文件编码
+            indexed: 重新扫描时是否保存为预建条目
+
+        Returns:
+            章节列表
+        """
+        entry = self.find_entry(file_path)
+        cached = None
+        try:
+            with open(entry, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('pattern') != CHAPTER_PATTERN_VERSION or cached.get('encoding') != encoding:
+                cached = None
+        except (OSError, ValueError):
+            cached = None
+
+        if cached is not None:
+            chapters = [Chapter(*item) for item in cached['chapters']]
+            if cached['fingerprint'] == fingerprint:
+                try:
+                    os.utime(entry)
+                except OSError:
+                    pass
+                return chapters
+            if self.is_appended(file_path, cached):
+                with perf.span('chapter_scan'):
+                    chapters = self.extend(text, chapters, encoding, cached)
+                return self.save(file_path, fingerprint, encoding, chapters, indexed)
+
+        with perf.span('chapter_scan'):
+            chapters = with_byte_offsets(text, scan_chapters(text), encoding, newline_width(file_path, encoding))
+        return self.save(file_path, fingerprint, encoding, chapters, indexed)
+
+    def is_current(self, file_path: str, fingerprint: str, encoding: str) -> bool:
+        """判断缓存的目录是否与文件内容一致"""
+        try:
+            with open(self.find_entry(file_path), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            return (cached.get('fingerprint') == fingerprint
+                    and cached.get('pattern') == CHAPTER_PATTERN_VERSION
+                    and cached.get('encoding') == encoding)
+        except (OSError, ValueError):
+            return False
+
+    def is_appended(self, file_path: str, cached: dict) -> bool:
+        """判断文件相对于缓存时是否只在末尾追加了内容"""
+        try:
+            size = os.path.getsize(file_path)
+            oldSize = cached['size']
+            if size <= oldSize:
+                return False
+            edge = min(self.EDGE_SIZE, oldSize)
+            return (_sample_digest(file_path, 0, edge) == cached['head']
+                    and _sample_digest(file_path, oldSize - edge, edge) == cached['tail'])
+        except (OSError, KeyError):
+            return False
+
+    def extend(self, text: str, chapters: list, encoding: str, cached: dict) -> list:
+        """从最后一个已知章节处继续扫描追加的内容"""
+        if not chapters:
+            return with_byte_offsets(text, scan_chapters(text), encoding, cached['newline'])
+        # 最后一章的标题行可能被追加的内容改变，从它开始重新扫描
+        last = chapters.pop()
+        base = chapters[-1] if chapters else None
+        added = scan_chapters(text, last.offset)
+        return chapters + with_byte_offsets(text, added, encoding, cached['newline'], base)
+
+    def save(self, file_path: str, fingerprint: str, encoding: str, chapters: list,
+             indexed: bool = False) -> list:
+        """保存章节目录，indexed 为 True 或已有预建条目时保存为预建条目，不触发淘汰"""
+        try:
+            size = os.path.getsize(file_path)
+            edge = min(self.EDGE_SIZE, size)
+            data = json.dumps({
+                'path': os.path.abspath(file_path),
+                'fingerprint': fingerprint,
+                'pattern': CHAPTER_PATTERN_VERSION,
+                'encoding': encoding,
+                'newline': newline_width(file_path, encoding),
+                'size': size,
+                'head': _sample_digest(file_path, 0, edge),
+                'tail': _sample_digest(file_path, size - edge, edge),
+                'chapters': [list(chapter) for chapter in chapters],
+            }, ensure_ascii=False).encode('utf-8')
+            entry = self.entry_path(file_path, True)
+            indexed = indexed or os.path.exists(entry)
+            if not indexed:
+                entry = self.entry_path(file_path)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            _atomic_write(entry, data)
+            if not indexed:
+                _report_eviction(self.cache_dir, self.max_bytes)
+        except OSError as e:
+            print(f"保存章节缓存失败: {e}")
+        return chapters
+
+
+def newline_width(file_path: str, encoding: str = None) -> int:
+    """根据文件开头判断每个换行符占用的字符数，CRLF 文件为 2
+
+    Args:
+        file_path: 文件路径
+        encoding: 文件编码，UTF-16、UTF-32 等编码中 \\r\\n 不是连续的两个字节，需要解码后判断；
+            未提供时按 ASCII 兼容的编码判断
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return 1
+    if encoding is None:
+        return 2 if b'\r\n' in sample else 1
+    try:
+        return 2 if '\r\n' in sample.decode(encoding, errors='ignore') else 1
+    except LookupError:
+        return 1
+
+
+class EncodingCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_entries: int = 4096):
+        """记录每个文件内容指纹检测出的编码，再次打开时跳过检测
+
+        Args:
+            cache_dir: 缓存目录
+            max_entries: 最多记录的文件数，超出时删除最早的记录
+        """
+        self.path = os.path.join(cache_dir, "encodings.json")
+        self.max_entries = max_entries
+        self.encodings = None
+
+    def load(self) -> dict:
+        if self.encodings is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.encodings = json.load(f)
+            except (OSError, ValueError):
+                self.encodings = {}
+        return self.encodings
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        return self.load().get(fingerprint)
+
+    def set(self, fingerprint: str, encoding: str) -> None:
+        self.update({fingerprint: encoding})
+
+    def update(self, mapping: dict) -> None:
+        """一次记录多个文件的编码，只写入一次"""
+        encodings = self.load()
+        if all(encodings.get(fingerprint) == encoding for fingerprint, encoding in mapping.items()):
+            return
+        for fingerprint, encoding in mapping.items():
+            encodings.pop(fingerprint, None)
+            encodings[fingerprint] = encoding
+        while len(encodings) > self.max_entries:
+            del encodings[next(iter(encodings))]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            _atomic_write(self.path, json.dumps(encodings).encode('utf-8'))
+        except OSError as e:
+            print(f"保存编码缓存失败: {e}")
+
+
+pageCache = PageCache()
+tocCache = TocCache()
+encodingCache = EncodingCache()
@@ -0,0 +1,109 @@
+import codecs
+import re
+from collections import namedtuple
+from typing import List, Tuple
+
+# 章节标题规则或字节偏移的换算变化时递增，使已缓存的目录失效
+CHAPTER_PATTERN_VERSION = 2
+
+# 在全文中定位章节标题的候选位置
+TITLE_PREFIX = re.compile(r'第[\u4e00-\u9fa5a-zA-Z0-9]{1,7}[章节]')
+# 去除首尾空白后的整行需要满足的格式
+TITLE_LINE = re.compile(r'第[\u4e00-\u9fa5a-zA-Z0-9]{1,7}[章节].{0,20}')
+# 大文件从中间开始扫描时，向前查找行首的最大字数
+MAX_TITLE_SCAN = 4096
+
+Chapter = namedtuple('Chapter', ['title', 'offset', 'byte_offset'], defaults=[-1])
+
+
+def scan_chapters(text, start: int = 0) -> List[Chapter]:
+    """扫描全文，按出现顺序返回章节列表
+
+    只对原始文本做一次正则扫描并记录字符偏移，不依赖排版；同名章节（如多卷本中重复的
+    "第一章"）会分别保留。
+
+    Args:
+        text: 全文，str 或 MappedDocument
+        start: 开始扫描的字符偏移
+
+    Returns:
+        章节列表，offset 为标题所在行去除缩进后的起始偏移，byte_offset 由 with_byte_offsets 计算
+    """
+    if isinstance(text, str):
+        return _scan_window(text, 0, start)
+    # 大文件按行对齐的窗口逐段扫描
+    chapters = []
+    # 只向前查找一小段，标题行不会很长，找不到行首时直接从 start 开始
+    lineStart = text.rfind('\n', max(0, start - MAX_TITLE_SCAN), start) + 1
+    if lineStart == 0 and start > MAX_TITLE_SCAN:
+        lineStart = start
+    for base, window in text.windows(lineStart):
+        chapters.extend(_scan_window(window, base, max(start - base, 0)))
+    return chapters
+
+
+def _scan_window(text: str, base: int, pos: int) -> List[Chapter]:
+    """扫描一段文本中的章节，base 为该段在全文中的起始偏移"""
+    chapters = []
+    while True:
+        match = TITLE_PREFIX.search(text, pos)
+        if match is None:
+            break
+        begin = match.start()
+        lineStart = text.rfind('\n', 0, begin) + 1
+        lineEnd = text.find('\n', begin)
+        if lineEnd == -1:
+            lineEnd = len(text)
+        # 标题必须位于行首（允许缩进）
+        if not text[lineStart:begin].strip():
+            title = text[begin:lineEnd].strip()
+            if TITLE_LINE.fullmatch(title):
+                chapters.append(Chapter(title, base + begin))
+        pos = lineEnd + 1
+    return chapters
+
+
+def without_bom(encoding: str) -> Tuple[str, int]:
+    """获取不带 BOM 的等价编码以及文件开头 BOM 的字节数
+
+    带 BOM 的编码逐段编码或解码时会重复处理 BOM，分段换算字节偏移时改用不带 BOM 的编码。
+    """
+    codec = codecs.lookup(encoding).name
+    if codec == 'utf-8-sig':
+        return 'utf-8', 3
+    if codec in ('utf-16', 'utf-32'):
+        return codec + '-le', 2 if codec == 'utf-16' else 4
+    return encoding, 0
+
+
+def with_byte_offsets(text: str, chapters: List[Chapter], encoding: str, newline_width: int = 1,
+                      base: Chapter = None) -> List[Chapter]:
+    """为章节补充在原文件中的字节偏移
+
+    Args:
+        text: 全文，str 或 MappedDocument
+        chapters: 按偏移排序的章节列表
+        encoding: 文件编码
+        newline_width: 文件中每个换行符占用的字符数，CRLF 文件为 2
+        base: 已知字节偏移的起点章节，从该处继续累计
+
+    Returns:
+        补充了 byte_offset 的章节列表
+    """
+    if not isinstance(text, str):
+        # 内存映射文档通过检查点直接换算，无需编码整段文本
+        offsets = text.byte_offsets([chapter.offset for chapter in chapters])
+        return [chapter._replace(byte_offset=offset) for chapter, offset in zip(chapters, offsets)]
+    # 带 BOM 的编码逐段编码时会重复加上 BOM，改用不带 BOM 的编码并单独计入 BOM 的长度
+    encoding, bomSize = without_bom(encoding)
+    # CRLF 文件中每个换行符多出的 \r 的字节数，UTF-16、UTF-32 中不止一个字节
+    extra = (newline_width - 1) * len('\r'.encode(encoding))
+    result = []
+    prev = base.offset if base else 0
+    byteOffset = base.byte_offset if base else bomSize
+    for chapter in chapters:
+        piece = text[prev:chapter.offset]
+        byteOffset += len(piece.encode(encoding, errors='replace')) + piece.count('\n') * extra
+        result.append(chapter._replace(byte_offset=byteOffset))
+        prev = chapter.offset
+    return result
@@ -0,0 +1,273 @@
+import codecs
+import mmap
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Iterator, List, Tuple, Union
+
+
+class MappedDocument:
+    # 每个解码窗口对应的字节数
+    BLOCK_SIZE = 256 * 1024
+
+    def __init__(self, path: str, encoding: str, max_blocks: int = 32):
+        """基于内存映射的文本文档，只解码被访问到的窗口
+
+        打开时按块扫描一遍文件，建立稀疏的字节偏移与字符偏移对照表（检查点），之后任意
+        字符位置都可以通过检查点定位到所在的块并只解码该块。换行符按 readText 的方式规范化，
+        \\r\\n 和 \\r 都视为 \\n。提供与 str 相同的 len、下标、切片和 find 接口，排版引擎可以
+        直接使用。仅支持 ASCII 兼容的编码（utf-8、gbk、big5 等）。
+
+        Args:
+            path: 文件路径
+            encoding: 文件编码
+            max_blocks: 最多保留的已解码块数，决定常驻内存的上限
+
+        Raises:
+            UnicodeDecodeError: 文件不能用指定编码解码
+        """
+        self.path = path
+        self.encoding = codecs.lookup(encoding).name
+        self.max_blocks = max_blocks
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self.map = b''
+        start = 0
+        if self.encoding == 'utf-8-sig':
+            # 跳过 BOM，之后的块都按普通 utf-8 解码
+            self.encoding = 'utf-8'
+            if self.map[:3] == codecs.BOM_UTF8:
+                start = 3
+        # 第 k 块从 byteMarks[k] 字节、charMarks[k] 字符开始
+        self.byteMarks = array('q', [start])
+        self.charMarks = array('q', [0])
+        self.blocks = OrderedDict()
+        # 最近访问的 (块号, 文本)，排版连续访问同一块时不必加锁
+        self.last = (-1, '')
+        # 同一文档会被界面线程和多个后台线程同时读取，保护已解码块的缓存
+        self.lock = threading.Lock()
+        try:
+            self.scan()
+        except UnicodeDecodeError:
+            self.close()
+            raise
+
+    def scan(self) -> None:
+        """扫描全文建立检查点，内存占用只与块大小有关"""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='strict')
+        data = self.map
+        size = len(data)
+        bytePos = self.byteMarks[0]
+        charPos = 0
+        while bytePos < size:
+            end = min(bytePos + self.BLOCK_SIZE, size)
+            chunk = decoder.decode(data[bytePos:end], final=end >= size)
+            pending = len(decoder.getstate()[0])
+            # 块末尾的 \r 留到下一块，保证 \r\n 不被拆开
+            if chunk.endswith('\r') and end < size:
+                chunk = chunk[:-1]
+                pending += 1
+            decoder.reset()
+            blockEnd = end - pending
+            charPos += len(chunk) - chunk.count('\r\n')
+            bytePos = blockEnd
+            self.byteMarks.append(bytePos)
+            self.charMarks.append(charPos)
+        self.length = charPos
+
+    def close(self) -> None:
+        with self.lock:
+            self.blocks.clear()
+            self.last = (-1, '')
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def block(self, index: int) -> str:
+        """获取第 index 块规范化后的文本"""
+        last = self.last
+        if last[0] == index:
+            return last[1]
+        with self.lock:
+            text = self.blocks.get(index)
+            if text is not None:
+                self.blocks.move_to_end(index)
+                self.last = (index, text)
+                return text
+        # 解码不持有锁，其他线程读取已解码的块不必等待
+        raw = self.map[self.byteMarks[index]:self.byteMarks[index + 1]].decode(self.encoding)
+        text = raw.replace('\r\n', '\n').replace('\r', '\n')
+        with self.lock:
+            self.blocks[index] = text
+            self.blocks.move_to_end(index)
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        self.last = (index, text)
+        return text
+
+    @property
+    def nbytes(self) -> int:
+        """常驻内存的估计上限：检查点数组加上全部已解码块"""
+        marks = (len(self.byteMarks) + len(self.charMarks)) * self.byteMarks.itemsize
+        # 解码后的块按每字节最多一个字符、每个字符最多两个字节估算
+        return marks + self.max_blocks * self.BLOCK_SIZE * 2
+
+    def block_of(self, pos: int) -> int:
+        """获取字符位置 pos 所在的块"""
+        return bisect_right(self.charMarks, pos, 0, len(self.charMarks) - 1) - 1
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key: Union[int, slice]) -> str:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                raise ValueError("MappedDocument 只支持连续切片")
+            return self.slice(start, stop)
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("MappedDocument index out of range")
+        index = self.block_of(key)
+        return self.block(index)[key - self.charMarks[index]]
+
+    def slice(self, start: int, stop: int) -> str:
+        """获取 [start, stop) 的文本"""
+        if start >= stop:
+            return ''
+        pieces = []
+        index = self.block_of(start)
+        while start < stop:
+            base = self.charMarks[index]
+            text = self.block(index)
+            piece = text[start - base:stop - base]
+            pieces.append(piece)
+            start = base + len(text)
+            index += 1
+        return ''.join(pieces)
+
+    def bounds(self, start: int, end: int) -> Tuple[int, int]:
+        """按 str.find 的规则换算查找范围，start 超出全文时返回空范围"""
+        length = self.length
+        if start < 0:
+            start = max(0, start + length)
+        elif start > length:
+            return length, -1
+        if end is None or end > length:
+            end = length
+        elif end < 0:
+            end = max(0, end + length)
+        return start, end
+
+    def find(self, sub: str, start: int = 0, end: int = None) -> int:
+        """与 str.find 相同，匹配内容可以跨越块的边界"""
+        if start < 0 or start > self.length or (end is not None and end < 0):
+            start, end = self.bounds(start, end)
+        elif end is None or end > self.length:
+            end = self.length
+        size = len(sub)
+        if size <= 1:
+            if not sub:
+                return start if start <= end else -1
+            last = end - 1
+        else:
+            last = end - size
+        index = self.block_of(start)
+        while start <= last:
+            base = self.charMarks[index]
+            text = self.block(index)
+            found = text.find(sub, start - base, end - base)
+            if found != -1:
+                return base + found
+            blockEnd = base + len(text)
+            if size > 1 and blockEnd < end:
+                # 从本块末尾开始、延伸到下一块的匹配
+                edge = max(start, blockEnd - size + 1)
+                found = self.slice(edge, min(end, blockEnd + size - 1)).find(sub)
+                if found != -1:
+                    return edge + found
+            start = blockEnd
+            index += 1
+        return -1
+
+    def rfind(self, sub: str, start: int = 0, end: int = None) -> int:
+        """与 str.rfind 相同，匹配内容可以跨越块的边界"""
+        start, end = self.bounds(start, end)
+        size = len(sub)
+        if end - start < size:
+            return -1
+        if not sub:
+            return end
+        # 从最后一个可能的匹配起点所在的块开始向前查找
+        index = self.block_of(end - size)
+        while True:
+            base = self.charMarks[index]
+            blockEnd = self.charMarks[index + 1]
+            if size > 1 and blockEnd < end:
+                # 从本块末尾开始、延伸到下一块的匹配在本块内的匹配之后
+                edge = max(start, blockEnd - size + 1)
+                found = self.slice(edge, min(end, blockEnd + size - 1)).rfind(sub)
+                if found != -1:
+                    return edge + found
+            found = self.block(index).rfind(sub, max(start, base) - base, min(end, blockEnd) - base)
+            if found != -1:
+                return base + found
+            if base <= start:
+                return -1
+            index -= 1
+
+    def windows(self, start: int = 0) -> Iterator[Tuple[int, str]]:
+        """从 start 开始依次返回 (起始偏移, 文本) 窗口
+
+        每个窗口都在换行处结束，行不会被拆开。只在下一块内查找换行符，超过一整块的长行
+        在块边界处拆开，避免没有换行的文件每个窗口都解码到文件末尾。
+        """
+        while start < self.length:
+            index = self.block_of(start)
+            stop = self.charMarks[index + 1]
+            if stop < self.length:
+                limit = self.charMarks[index + 2]
+                lineEnd = self.find('\n', stop, limit)
+                stop = limit if lineEnd == -1 else lineEnd + 1
+            yield start, self.slice(start, stop)
+            start = stop
+
+    def byte_offset(self, pos: int) -> int:
+        """获取字符位置 pos 在原文件中的字节偏移"""
+        return self.byte_offsets([pos])[0]
+
+    def byte_offsets(self, positions: List[int]) -> List[int]:
+        """批量获取字符位置在原文件中的字节偏移
+
+        同一块内的位置共用一次解码，并且只编码相邻位置之间的文本，位置按升序排列时最快。
+        """
+        result = []
+        index = -1
+        for pos in positions:
+            if pos >= self.length:
+                result.append(len(self.map))
+                continue
+            block = self.block_of(pos)
+            if block != index or pos < charPos:
+                # 进入新的一块，从块起点开始累计
+                index = block
+                raw = self.map[self.byteMarks[index]:self.byteMarks[index + 1]].decode(self.encoding)
+                charPos = self.charMarks[index]
+                rawPos = 0
+                byteOffset = self.byteMarks[index]
+                crlf = raw.find('\r\n')
+            rawEnd = rawPos + (pos - charPos)
+            # 规范化时每个 \r\n 少计一个字符，换算回原始文本中的位置
+            while crlf != -1 and crlf < rawEnd:
+                rawEnd += 1
+                crlf = raw.find('\r\n', crlf + 2)
+            byteOffset += len(raw[rawPos:rawEnd].encode(self.encoding))
+            rawPos = rawEnd
+            charPos = pos
+            result.append(byteOffset)
+        return result
@@ -1,88 +1,220 @@
 import os
-import tempfile
-from typing import Dict, Optional
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+from bookcache import encodingCache, file_fingerprint
+from document import MappedDocument
+from textcodec import decode_file, detect_encoding, is_ascii_compatible
+import perf
+
+# 超过该大小的文件使用内存映射按需解码，不再整体读入内存
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+
+def read_content(path: str, encodings: List[str], size: int = None) -> Tuple[Any, str]:
+    """按候选编码读取文件，超过 LARGE_FILE_SIZE 的文件使用内存映射
+
+    Args:
+        path: 文件路径
+        encodings: 按优先级排列的候选编码
+        size: 文件大小，未提供时读取
+
+    Returns:
+        (规范化后的全文或 MappedDocument, 实际使用的编码)
+
+    Raises:
+        OSError: 文件无法读取或不能用任何候选编码解码
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    if size >= LARGE_FILE_SIZE and is_ascii_compatible(encodings[0]):
+        for encoding in encodings:
+            try:
+                with perf.span('map_document'):
+                    return MappedDocument(path, encoding), encoding
+            except UnicodeDecodeError:
+                pass
+        raise IOError(f"Could not decode the file {path} with any of the encodings: {encodings}")
+    return decode_file(path, encodings)
+
+
+def estimate_bytes(value: Any) -> int:
+    """估算缓存对象占用的内存字节数"""
+    if isinstance(value, array):
+        return sys.getsizeof(value)
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        # 章节列表等由小对象组成的容器，再计算一层元素
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class ContentEntry:
+    def __init__(self, owner: 'ContentCache', path: str, mtime: int, size: int, text, encoding: str):
+        """一个已解码文件的缓存条目
 
-class FileCache:
-    def __init__(self, max_cache_size: int = 5):
-        """初始化文件缓存管理器
-        
         Args:
-            max_cache_size: 最大缓存文件数量
+            owner: 所属的缓存
+            path: 文件的绝对路径
+            mtime: 读取前文件的修改时间（纳秒）
+            size: 读取前文件的大小
+            text: 规范化后的全文，大文件为 MappedDocument
+            encoding: 文件编码
         """
-        self.max_cache_size = max_cache_size
-        self.cache_dir = tempfile.mkdtemp(prefix='reader_cache_')
-        self.cache_files: Dict[str, str] = {}
-        self.cache_order: list = []
-
-    def get_cached_content(self, file_path: str) -> Optional[str]:
-        """获取缓存的文件内容
-        
+        self.owner = owner
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.text = text
+        self.encoding = encoding
+        # 由全文派生的索引，如指纹、章节目录
+        self.derived: Dict[str, Any] = {}
+        self.nbytes = estimate_bytes(text)
+
+    def derive(self, name: str, build: Callable[[], Any]) -> Any:
+        """获取名为 name 的派生索引，不存在时调用 build 建立并计入缓存大小"""
+        if name in self.derived:
+            return self.derived[name]
+        value = build()
+        self.set_derived(name, value)
+        return value
+
+    def set_derived(self, name: str, value: Any) -> None:
+        """记录派生索引，替换同名的旧值"""
+        old = self.derived.get(name)
+        self.derived[name] = value
+        delta = estimate_bytes(value) - (estimate_bytes(old) if old is not None else 0)
+        self.owner.resize(self, delta)
+
+
+class ContentCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """进程内共用的已解码内容缓存
+
+        以文件绝对路径为键，保存解码并规范化后的全文以及派生索引。每次读取都会比对文件的
+        修改时间和大小，不一致时丢弃条目重新读取，不会返回过期内容。条目总大小超过 max_bytes
+        时按最近使用顺序淘汰，超过预算的单个文件不进入缓存。
+
         Args:
-            file_path: 原始文件路径
-            
-        Returns:
-            缓存的文件内容，如果不存在则返回 None
+            max_bytes: 缓存的最大总字节数
         """
-        if file_path in self.cache_files:
-            cache_path = self.cache_files[file_path]
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries: 'OrderedDict[str, ContentEntry]' = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, file_path: str) -> Optional[ContentEntry]:
+        """获取有效的缓存条目，文件已修改或不存在时返回 None"""
+        path = os.path.abspath(file_path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
             try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except:
+                stat = os.stat(path)
+                valid = stat.st_mtime_ns == entry.mtime and stat.st_size == entry.size
+            except OSError:
+                valid = False
+            if not valid:
+                self.stale += 1
+                self.remove(path)
                 return None
-        return None
+            self.entries.move_to_end(path)
+            return entry
+
+    def load(self, file_path: str) -> ContentEntry:
+        """读取文件，命中缓存时直接返回
+
+        未命中时按记录的编码或采样检测的编码解码，超过 LARGE_FILE_SIZE 的文件使用内存映射。
 
-    def cache_file(self, file_path: str) -> None:
-        """缓存文件内容
-        
         Args:
-            file_path: 需要缓存的文件路径
+            file_path: 文件路径
+
+        Returns:
+            缓存条目，派生索引中包含文件指纹 fingerprint
+
+        Raises:
+            OSError: 文件不存在或无法解码
         """
-        if file_path in self.cache_files:
-            return
+        entry = self.get(file_path)
+        with self.lock:
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
 
-        # 如果缓存已满，删除最早的缓存
-        if len(self.cache_files) >= self.max_cache_size:
-            oldest_file = self.cache_order.pop(0)
-            cache_path = self.cache_files.pop(oldest_file)
-            try:
-                os.remove(cache_path)
-            except:
-                pass
+        path = os.path.abspath(file_path)
+        # 在读取之前记录修改时间，读取期间文件被修改时下次校验会失败
+        stat = os.stat(path)
+        fingerprint = file_fingerprint(path)
+        # 打开过的文件直接使用记录的编码，否则采样检测
+        known = encodingCache.get(fingerprint)
+        if known:
+            encodings = [known]
+        else:
+            with perf.span('detect_encoding'):
+                encodings = detect_encoding(path)
+        text, encoding = read_content(path, encodings, stat.st_size)
+        encodingCache.set(fingerprint, encoding)
 
-        # 创建新的缓存文件
-        cache_path = os.path.join(self.cache_dir,
-                                  f'cache_{len(self.cache_files)}')
-        try:
-            # 使用分块读取来处理大文件
-            with open(file_path, 'r', encoding='utf-8') as src, \
-                    open(cache_path, 'w', encoding='utf-8') as dst:
-                while True:
-                    chunk = src.read(8192)  # 8KB 的块大小
-                    if not chunk:
-                        break
-                    dst.write(chunk)
-
-            self.cache_files[file_path] = cache_path
-            self.cache_order.append(file_path)
-        except:
-            pass
-
-    def clear_cache(self) -> None:
-        """清理所有缓存文件"""
-        for cache_path in self.cache_files.values():
-            try:
-                os.remove(cache_path)
-            except:
-                pass
-        try:
-            os.rmdir(self.cache_dir)
-        except:
-            pass
-        self.cache_files.clear()
-        self.cache_order.clear()
-
-    def __del__(self):
-        """析构时清理缓存"""
-        self.clear_cache()
+        entry = ContentEntry(self, path, stat.st_mtime_ns, stat.st_size, text, encoding)
+        entry.derived['fingerprint'] = fingerprint
+        with self.lock:
+            self.remove(path)
+            if entry.nbytes <= self.max_bytes:
+                self.entries[path] = entry
+                self.total_bytes += entry.nbytes
+                self.evict()
+        return entry
+
+    def resize(self, entry: ContentEntry, delta: int) -> None:
+        """派生索引变化后更新条目大小"""
+        with self.lock:
+            entry.nbytes += delta
+            if self.entries.get(entry.path) is entry:
+                self.total_bytes += delta
+                self.evict()
+
+    def remove(self, file_path: str) -> None:
+        with self.lock:
+            entry = self.entries.pop(os.path.abspath(file_path), None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+
+    def evict(self) -> None:
+        """淘汰最久未使用的条目，直到总大小不超过预算"""
+        with self.lock:
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, entry = self.entries.popitem(last=False)
+                self.total_bytes -= entry.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存的统计数据"""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'stale': self.stale,
+            }
+
+
+contentCache = ContentCache()
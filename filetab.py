@@ -1,5 +1,4 @@
 from PySide6.QtWidgets import QWidget, QPushButton, QHBoxLayout, QFileDialog
-from readwindow import ReadWindow
 
 
 class FileTab(QWidget):
@@ -19,6 +18,8 @@ class FileTab(QWidget):
     def openFileDialog(self):
         fileName, _ = QFileDialog.getOpenFileName(self, "选择文本文件", "", "Text Files (*.txt)")
         if fileName:
+            # 阅读窗口依赖较多，打开文件时才导入，缩短启动时间
+            from readwindow import ReadWindow
             if self.readWindow is None:
                 self.readWindow = ReadWindow(fileName)
             else:
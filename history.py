@@ -0,0 +1,258 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import perf
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# 阅读历史数据库，与程序放在同一目录
+HISTORY_DB = os.path.join(_APP_DIR, "history.db")
+# 旧版的阅读历史，第一次建立数据库时导入
+HISTORY_FILE = os.path.join(_APP_DIR, "history.json")
+# 数据库结构版本，保存在 PRAGMA user_version 中
+SCHEMA_VERSION = 2
+
+# 检查文件是否存在的线程池，网络共享上的检查可能很慢，不能在界面线程中进行
+_exists_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='history-exists')
+
+
+class HistoryStore:
+    def __init__(self, db_path: str = HISTORY_DB, json_path: str = HISTORY_FILE,
+                 max_entries: int = 5000, delay: float = 1.0):
+        """阅读历史和每本书的阅读位置
+
+        全部记录读入内存，按最近打开的顺序排列，修改只改内存并记下待写入的变化，
+        delay 秒内的多次修改合并为一个 SQLite 事务在后台写入，退出时写入剩余的变化。
+        阅读位置以内容指纹为键，改名或移动过的文件也能找到，打开书时按主键查询。
+
+        Args:
+            db_path: 数据库路径
+            json_path: 旧版 history.json 的路径，数据库不存在时从中导入
+            max_entries: 最多保留的记录数，阅读位置同样最多保留这么多本书
+            delay: 修改后延迟写入的秒数
+        """
+        self.db_path = db_path
+        self.json_path = json_path
+        self.max_entries = max_entries
+        self.delay = delay
+        # 路径 -> {'path', 'name', 'time'}，最近打开的在前
+        self.entries: Optional['OrderedDict[str, dict]'] = None
+        # 待写入的变化，路径 -> 记录，None 表示删除
+        self.pending: Dict[str, Optional[dict]] = {}
+        self.cleared = False
+        # 待写入的阅读位置，内容指纹 -> 位置
+        self.pending_positions: Dict[str, dict] = {}
+        self.timer: Optional[threading.Timer] = None
+        self.lock = threading.RLock()
+        # 保证多次写入按顺序进行
+        self.write_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            with conn:
+                if version < 1:
+                    conn.execute('CREATE TABLE IF NOT EXISTS history ('
+                                 'path TEXT PRIMARY KEY, name TEXT NOT NULL, time TEXT NOT NULL)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS history_time ON history (time)')
+                    self.migrate(conn)
+                if version < 2:
+                    conn.execute('CREATE TABLE IF NOT EXISTS positions (fingerprint TEXT PRIMARY KEY, '
+                                 'anchor INTEGER NOT NULL, layout TEXT NOT NULL, time TEXT NOT NULL)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS positions_time ON positions (time)')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return conn
+
+    def migrate(self, conn: sqlite3.Connection) -> None:
+        """导入旧版 history.json 中的记录"""
+        try:
+            with open(self.json_path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            return
+        # 旧版记录最近的在前，倒序插入使 rowid 与打开顺序一致
+        rows = [(item['path'], item.get('name') or os.path.basename(item['path']), item.get('time', ''))
+                for item in reversed(history) if isinstance(item, dict) and item.get('path')]
+        conn.executemany('INSERT OR REPLACE INTO history (path, name, time) VALUES (?, ?, ?)', rows)
+
+    @perf.timed('history_io')
+    def load(self) -> 'OrderedDict[str, dict]':
+        """读取全部记录，只在第一次使用时读取数据库"""
+        with self.lock:
+            if self.entries is not None:
+                return self.entries
+            self.entries = OrderedDict()
+            try:
+                conn = self.connect()
+                try:
+                    rows = conn.execute('SELECT path, name, time FROM history ORDER BY time DESC, rowid DESC '
+                                        'LIMIT ?', (self.max_entries,)).fetchall()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"读取历史记录失败: {e}")
+                rows = []
+            for path, name, time in rows:
+                self.entries[path] = {'path': path, 'name': name, 'time': time}
+            return self.entries
+
+    def items(self) -> List[dict]:
+        """获取全部记录的副本，最近打开的在前"""
+        with self.lock:
+            return [dict(item) for item in self.load().values()]
+
+    def add(self, file_path: str) -> None:
+        """记录打开了文件，已有的记录移到最前"""
+        item = {
+            'path': file_path,
+            'name': os.path.basename(file_path),
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self.lock:
+            entries = self.load()
+            entries[file_path] = item
+            entries.move_to_end(file_path, last=False)
+            # 重新插入，使写入顺序与打开顺序一致
+            self.pending.pop(file_path, None)
+            self.pending[file_path] = item
+            while len(entries) > self.max_entries:
+                path, _ = entries.popitem()
+                self.pending[path] = None
+            self.schedule()
+
+    def remove(self, file_path: str) -> None:
+        with self.lock:
+            if self.load().pop(file_path, None) is not None:
+                self.pending[file_path] = None
+                self.schedule()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.load().clear()
+            self.pending.clear()
+            self.cleared = True
+            self.schedule()
+
+    def position(self, fingerprint: str) -> Optional[dict]:
+        """获取一本书保存的阅读位置
+
+        Returns:
+            {'anchor': 页首的字符偏移, 'layout': 保存时的排版标识}，没有记录时返回 None
+        """
+        with self.lock:
+            pending = self.pending_positions.get(fingerprint)
+            if pending is not None:
+                return {'anchor': pending['anchor'], 'layout': pending['layout']}
+        try:
+            conn = self.connect()
+            try:
+                row = conn.execute('SELECT anchor, layout FROM positions WHERE fingerprint = ?',
+                                   (fingerprint,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"读取阅读位置失败: {e}")
+            return None
+        return {'anchor': row[0], 'layout': row[1]} if row else None
+
+    def set_position(self, fingerprint: str, anchor: int, layout: str) -> None:
+        """记录一本书的阅读位置，与历史记录一起延迟写入"""
+        with self.lock:
+            self.pending_positions[fingerprint] = {
+                'anchor': anchor,
+                'layout': layout,
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self.schedule()
+
+    def schedule(self) -> None:
+        """延迟写入，期间的修改合并为一次写入"""
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    @perf.timed('history_io')
+    def flush(self) -> None:
+        """在一个事务中写入所有待写入的变化"""
+        with self.write_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                pending, cleared, positions = self.pending, self.cleared, self.pending_positions
+                self.pending, self.cleared, self.pending_positions = {}, False, {}
+            if not pending and not cleared and not positions:
+                return
+            try:
+                conn = self.connect()
+                try:
+                    with conn:
+                        if cleared:
+                            conn.execute('DELETE FROM history')
+                        conn.executemany('DELETE FROM history WHERE path = ?',
+                                         [(path,) for path, item in pending.items() if item is None])
+                        conn.executemany('INSERT OR REPLACE INTO history (path, name, time) VALUES (?, ?, ?)',
+                                         [(item['path'], item['name'], item['time'])
+                                          for item in pending.values() if item is not None])
+                        if positions:
+                            conn.executemany('INSERT OR REPLACE INTO positions (fingerprint, anchor, layout, time) '
+                                             'VALUES (?, ?, ?, ?)',
+                                             [(fingerprint, item['anchor'], item['layout'], item['time'])
+                                              for fingerprint, item in positions.items()])
+                            conn.execute('DELETE FROM positions WHERE fingerprint NOT IN (SELECT fingerprint '
+                                         'FROM positions ORDER BY time DESC LIMIT ?)', (self.max_entries,))
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"保存历史记录失败: {e}")
+                self.restore(pending, cleared, positions)
+
+    def restore(self, pending: Dict[str, Optional[dict]], cleared: bool, positions: Dict[str, dict]) -> None:
+        """写入失败时放回未写入的变化并重新安排写入，不覆盖期间产生的更新的变化"""
+        with self.lock:
+            if not self.cleared:
+                # 期间清空过历史时，之前的变化都已作废
+                merged = {path: item for path, item in pending.items() if path not in self.pending}
+                merged.update(self.pending)
+                self.pending = merged
+                self.cleared = cleared
+            merged = {fingerprint: item for fingerprint, item in positions.items()
+                      if fingerprint not in self.pending_positions}
+            merged.update(self.pending_positions)
+            self.pending_positions = merged
+            self.schedule()
+
+    def most_recent_file(self) -> Optional[str]:
+        """获取最近打开且仍然存在的文件"""
+        for item in self.items():
+            if os.path.exists(item['path']):
+                return item['path']
+        return None
+
+    def check_exists(self, paths: List[str], callback: Callable[[str, bool], None]) -> List[Future]:
+        """在后台线程中检查文件是否存在，每检查完一个就在工作线程中调用 callback(path, exists)
+
+        Returns:
+            各个检查任务，不再需要结果时可以取消
+        """
+        def check(path):
+            callback(path, os.path.exists(path))
+        return [_exists_pool.submit(check, path) for path in paths]
+
+
+historyStore = HistoryStore()
+
+
+def get_most_recent_file():
+    """获取最近打开的文件"""
+    return historyStore.most_recent_file()
@@ -0,0 +1,187 @@
+"""书库预索引
+
+遍历目录下的所有书籍，用进程池并行建立编码记录、内容指纹、当前排版的分页索引和章节目录，
+写入缓存目录下的 indexed 子目录，之后用阅读器打开这些书时直接使用缓存。
+预建的条目不参与阅读器缓存按大小的淘汰，只按 --cache-budget 指定的预算淘汰，淘汰时会报告。加上 --search 时同时把书加入书库搜索索引。
+
+    python indexer.py D:/books --workers 4 --search
+
+每本书的结果单独原子写入，中断后重新运行会跳过已经完成的书，分页到一半的书从保存的位置继续。
+"""
+import argparse
+import configparser
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from bookcache import INDEXED_DIR, encodingCache, evict_cache_dir, file_fingerprint, newline_width, pageCache, tocCache
+from chapters import scan_chapters, with_byte_offsets
+from filecache import read_content
+from libraryindex import libraryIndex
+from pageindex import PageIndex
+from textcodec import detect_encoding
+from textlayout import TextLayout
+
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.ini")
+EXTENSIONS = ['.txt']
+# 分页时每隔该秒数保存一次已完成的部分，中断后从保存的位置继续
+SAVE_INTERVAL = 10.0
+# 每完成该数量的书写入一次编码记录
+ENCODING_FLUSH = 50
+
+
+def read_layout(settings_path: str) -> Optional[TextLayout]:
+    """按设置文件创建与阅读器一致的排版
+
+    按字符实际宽度折行需要字体度量，只能在阅读器中建立，此时返回 None，只预建编码和目录。
+    """
+    config = configparser.ConfigParser()
+    config.read(settings_path, encoding='utf-8')
+    if config.get('settings', 'wrapmode', fallback='chars') == 'glyph':
+        return None
+    return TextLayout(config.getint('settings', 'linesize', fallback=20),
+                      config.getint('settings', 'textline', fallback=2))
+
+
+def find_books(root: str, extensions: List[str]) -> List[str]:
+    """递归查找目录下的书籍，返回按路径排序的绝对路径"""
+    books = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in extensions:
+                books.append(os.path.abspath(os.path.join(dirpath, name)))
+    books.sort()
+    return books
+
+
+def index_book(path: str, layout: Optional[TextLayout], force: bool = False, search: bool = False) -> Dict:
+    """建立一本书的索引，在子进程中运行
+
+    编码记录只在主进程中写入，避免多个进程同时改写同一个文件。
+
+    Args:
+        path: 书籍的绝对路径
+        layout: 排版，None 时不建立分页索引
+        force: 为 True 时忽略已有的缓存重新建立
+        search: 为 True 时同时更新书库搜索索引
+
+    Returns:
+        结果字典，包含 path、status（indexed、skipped 或 failed）、fingerprint、encoding、
+        pages、chapters、seconds，失败时包含 error
+    """
+    start = time.perf_counter()
+    result = {'path': path, 'status': 'indexed', 'pages': None, 'chapters': None}
+    try:
+        fingerprint = file_fingerprint(path)
+        known = encodingCache.get(fingerprint)
+        result['fingerprint'] = fingerprint
+        if (not force and known
+                and (layout is None or pageCache.is_complete(path, fingerprint, layout.key))
+                and tocCache.is_current(path, fingerprint, known)
+                and (not search or libraryIndex.is_current(path, fingerprint))):
+            result.update(status='skipped', encoding=known, seconds=time.perf_counter() - start)
+            return result
+
+        encodings = [known] if known else detect_encoding(path)
+        text, encoding = read_content(path, encodings)
+        result['encoding'] = encoding
+        try:
+            if layout is not None:
+                index = PageIndex(lambda mark: layout.next_mark(text, mark), len(text))
+                if not force:
+                    pageCache.load(path, fingerprint, layout.key, index)
+                saved = time.perf_counter()
+                while not index.complete:
+                    index.extend(1024)
+                    if time.perf_counter() - saved > SAVE_INTERVAL:
+                        pageCache.save(path, fingerprint, layout.key, index, indexed=True)
+                        saved = time.perf_counter()
+                pageCache.save(path, fingerprint, layout.key, index, indexed=True)
+                result['pages'] = index.page_count
+            if force:
+                chapters = tocCache.save(path, fingerprint, encoding, with_byte_offsets(
+                    text, scan_chapters(text), encoding, newline_width(path, encoding)), indexed=True)
+            else:
+                chapters = tocCache.get_chapters(path, fingerprint, text, encoding, indexed=True)
+            result['chapters'] = len(chapters)
+            if search and (force or not libraryIndex.is_current(path, fingerprint)):
+                libraryIndex.add_book(path, fingerprint, text, encoding)
+        finally:
+            if hasattr(text, 'close'):
+                text.close()
+    except (OSError, ValueError) as e:
+        result.update(status='failed', error=str(e))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="预先建立书库中所有书籍的索引")
+    parser.add_argument('library', help="书库目录")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行的进程数")
+    parser.add_argument('--settings', default=SETTINGS_PATH, help="读取排版参数的设置文件")
+    parser.add_argument('--extensions', default=','.join(EXTENSIONS), help="书籍扩展名，逗号分隔")
+    parser.add_argument('--force', action='store_true', help="忽略已有的缓存，全部重新建立")
+    parser.add_argument('--search', action='store_true', help="同时建立书库搜索索引")
+    parser.add_argument('--cache-budget', type=int, default=0,
+                        help="预建缓存的最大 MB 数，超出时删除最久未使用的条目，0 表示不限制")
+    args = parser.parse_args(argv)
+
+    extensions = [ext.lower() if ext.startswith('.') else '.' + ext.lower()
+                  for ext in args.extensions.split(',') if ext]
+    books = find_books(args.library, extensions)
+    if not books:
+        print(f"{args.library} 中没有找到书籍")
+        return 0
+    layout = read_layout(args.settings)
+    if layout is None:
+        print("设置为按字符宽度折行，分页索引需在阅读器中建立，只预建编码和目录")
+
+    counts = {'indexed': 0, 'skipped': 0, 'failed': 0}
+    encodings = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(index_book, path, layout, args.force, args.search) for path in books]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                counts[result['status']] += 1
+                name = os.path.relpath(result['path'], args.library)
+                if result['status'] == 'failed':
+                    print(f"[{done}/{len(books)}] 失败 {name}: {result['error']}")
+                    continue
+                encodings[result['fingerprint']] = result['encoding']
+                if len(encodings) >= ENCODING_FLUSH:
+                    encodingCache.update(encodings)
+                    encodings.clear()
+                if result['status'] == 'skipped':
+                    print(f"[{done}/{len(books)}] 跳过 {name}")
+                else:
+                    pages = f"{result['pages']} 页, " if result['pages'] is not None else ''
+                    print(f"[{done}/{len(books)}] {name}: {result['encoding']}, {pages}"
+                          f"{result['chapters']} 章, {result['seconds']:.2f} s")
+        except KeyboardInterrupt:
+            # 已完成的书都已写入缓存，下次运行时跳过
+            for future in futures:
+                future.cancel()
+            print("已中断，重新运行可继续")
+            return 130
+        finally:
+            if encodings:
+                encodingCache.update(encodings)
+
+    print(f"完成 {counts['indexed']} 本，跳过 {counts['skipped']} 本，失败 {counts['failed']} 本，"
+          f"用时 {time.perf_counter() - start:.1f} s")
+    if args.cache_budget > 0:
+        # 全部完成后再淘汰，运行中的进程不会删除彼此刚建立的条目
+        removed = evict_cache_dir(INDEXED_DIR, args.cache_budget * 1024 * 1024)
+        if removed:
+            print(f"预建缓存超出 {args.cache_budget} MB，删除了 {removed} 个最久未使用的条目，"
+                  f"这些书下次运行时会重新建立，可以增大 --cache-budget")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import os
+import sqlite3
+from array import array
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+import perf
+from bookcache import CACHE_DIR, newline_width
+from chapters import Chapter, with_byte_offsets, without_bom
+from searchindex import snippet
+from textcodec import normalize
+
+# 书库索引放在缓存目录的子目录中，不参与缓存目录按大小的淘汰
+LIBRARY_DB = os.path.join(CACHE_DIR, "library", "library.db")
+# 索引格式变化时递增，旧的索引会被清空重建
+INDEX_VERSION = 2
+# 全文按该字数分块，索引只记录每两字出现在哪些块中，查询时只解码候选块
+BLOCK_SIZE = 16384
+# 建立索引时每处理该数量的块在一个短事务中写入一次，内存占用与书的大小无关，
+# 其他进程的写入不必等待整本书完成
+FLUSH_BLOCKS = 64
+
+SearchHit = namedtuple('SearchHit', ['path', 'name', 'offset', 'snippet'])
+
+
+class LibraryIndex:
+    def __init__(self, db_path: str = LIBRARY_DB):
+        """跨书籍的全文倒排索引
+
+        以相邻两字为键，记录每本书中包含它的块号，保存在 SQLite 中，按书增量更新。
+        查询时先用索引求出可能包含查询词的书和块，再只读取并解码这些块核对，
+        不需要解码整本书。正在建立的书在 books 中标记为未完成，查询时不使用，
+        建立完成后在一个短事务中替换旧的索引。
+
+        Args:
+            db_path: 数据库路径
+        """
+        self.db_path = db_path
+
+    def connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # 预索引工具的多个进程可能同时写入
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute('PRAGMA journal_mode = WAL')
+        if conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+            with conn:
+                # 先取得写锁再重新检查版本，其他进程可能在等待期间已经完成了重建
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+                    conn.execute('DROP TABLE IF EXISTS postings')
+                    conn.execute('DROP TABLE IF EXISTS books')
+                    # 同一路径在重建期间会有一条未完成的记录和一条旧的完整记录
+                    conn.execute('CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, path TEXT NOT NULL, '
+                                 'fingerprint TEXT NOT NULL, encoding TEXT NOT NULL, size INTEGER NOT NULL, '
+                                 'mtime INTEGER NOT NULL, length INTEGER NOT NULL, block_bytes BLOB NOT NULL, '
+                                 'time TEXT NOT NULL, complete INTEGER NOT NULL DEFAULT 0)')
+                    conn.execute('CREATE INDEX IF NOT EXISTS books_path ON books (path)')
+                    # 同一本书的同一个两字可能分多次写入，part 为写入的序号
+                    conn.execute('CREATE TABLE IF NOT EXISTS postings (bigram TEXT NOT NULL, '
+                                 'book INTEGER NOT NULL, part INTEGER NOT NULL, blocks BLOB NOT NULL, '
+                                 'PRIMARY KEY (bigram, book, part)) WITHOUT ROWID')
+                    conn.execute('CREATE INDEX IF NOT EXISTS postings_book ON postings (book)')
+                    conn.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+        return conn
+
+    def is_current(self, file_path: str, fingerprint: str) -> bool:
+        """书籍是否已按当前内容建立索引"""
+        try:
+            conn = self.connect()
+            try:
+                row = conn.execute('SELECT fingerprint FROM books WHERE path = ? AND complete = 1',
+                                   (os.path.abspath(file_path),)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == fingerprint
+
+    def add_book(self, file_path: str, fingerprint: str, text, encoding: str,
+                 cancelled: Optional[Callable[[], bool]] = None) -> bool:
+        """建立或更新一本书的索引
+
+        新的索引分多个短事务写入一条未完成的记录，完成后再在一个短事务中替换旧的索引，
+        其他线程或进程在此期间可以查询和写入。
+
+        Args:
+            file_path: 文件路径
+            fingerprint: 文件内容指纹
+            text: 规范化后的全文，可以是 MappedDocument
+            encoding: 文件编码
+            cancelled: 返回 True 时放弃本次更新，保留旧的索引
+
+        Returns:
+            是否更新完成
+        """
+        path = os.path.abspath(file_path)
+        length = len(text)
+        stat = os.stat(path)
+        starts = [Chapter('', start) for start in range(0, length, BLOCK_SIZE)]
+        # 每块起始位置在文件中的字节偏移，最后加上文件大小作为结尾
+        block_bytes = array('q', [chapter.byte_offset for chapter in
+                                  with_byte_offsets(text, starts, encoding, newline_width(path, encoding))])
+        block_bytes.append(stat.st_size)
+
+        book = None
+        try:
+            with perf.span('library_index'):
+                conn = self.connect()
+                try:
+                    with conn:
+                        book = conn.execute(
+                            'INSERT INTO books (path, fingerprint, encoding, size, mtime, length, block_bytes, time) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (path, fingerprint, encoding, stat.st_size, stat.st_mtime_ns, length,
+                             block_bytes.tobytes(), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+                    if not self._write_postings(conn, book, text, cancelled):
+                        self._remove_books(conn, [book])
+                        return False
+                    with conn:
+                        # 另一个线程或进程同时重建了这本书并删除了本条记录时，以对方的为准
+                        if conn.execute('UPDATE books SET complete = 1 WHERE id = ?', (book,)).rowcount == 0:
+                            conn.execute('DELETE FROM postings WHERE book = ?', (book,))
+                            return False
+                        # 旧的索引以及中断后遗留的未完成记录
+                        conn.execute('DELETE FROM postings WHERE book IN '
+                                     '(SELECT id FROM books WHERE path = ? AND id != ?)', (path, book))
+                        conn.execute('DELETE FROM books WHERE path = ? AND id != ?', (path, book))
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            print(f"更新书库索引失败: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def _write_postings(conn: sqlite3.Connection, book: int, text,
+                        cancelled: Optional[Callable[[], bool]]) -> bool:
+        postings: Dict[str, array] = {}
+        part = 0
+        length = len(text)
+        block = 0
+        for start in range(0, length, BLOCK_SIZE):
+            if cancelled is not None and cancelled():
+                return False
+            # 多取一个字，跨块的两字记在前一块
+            chunk = text[start:start + BLOCK_SIZE + 1]
+            for key in {chunk[i:i + 2] for i in range(len(chunk) - 1)}:
+                blocks = postings.get(key)
+                if blocks is None:
+                    blocks = postings[key] = array('I')
+                blocks.append(block)
+            block += 1
+            if block % FLUSH_BLOCKS == 0 or start + BLOCK_SIZE >= length:
+                with conn:
+                    conn.executemany('INSERT INTO postings (bigram, book, part, blocks) VALUES (?, ?, ?, ?)',
+                                     [(key, book, part, blocks.tobytes()) for key, blocks in postings.items()])
+                postings.clear()
+                part += 1
+        return True
+
+    @staticmethod
+    def _remove_books(conn: sqlite3.Connection, books: List[int]) -> None:
+        """在一个事务中删除书籍记录和它们的索引"""
+        if not books:
+            return
+        with conn:
+            conn.executemany('DELETE FROM postings WHERE book = ?', [(book,) for book in books])
+            conn.executemany('DELETE FROM books WHERE id = ?', [(book,) for book in books])
+
+    def remove(self, file_path: str) -> None:
+        conn = self.connect()
+        try:
+            books = [row[0] for row in conn.execute('SELECT id FROM books WHERE path = ?',
+                                                    (os.path.abspath(file_path),))]
+            self._remove_books(conn, books)
+        finally:
+            conn.close()
+
+    @perf.timed('library_search')
+    def search(self, query: str, limit: int = 1000, per_book: int = 100) -> List[SearchHit]:
+        """在所有已索引的书中查找 query
+
+        Args:
+            query: 查询词，至少两个字
+            limit: 最多返回的结果数
+            per_book: 每本书最多返回的结果数
+
+        Returns:
+            结果列表，按书和位置排列；文件已修改的书被跳过，已删除或改名的书的索引被删除
+        """
+        bigrams = list(dict.fromkeys(query[i:i + 2] for i in range(len(query) - 1)))
+        if not bigrams or len(query) > BLOCK_SIZE:
+            return []
+        conn = self.connect()
+        try:
+            # 每个两字在各本书中出现的块，出现的书少的先查，尽早排除不相关的书
+            counts = dict(conn.execute(f'SELECT bigram, COUNT(*) FROM postings WHERE bigram IN '
+                                       f'({",".join("?" * len(bigrams))}) GROUP BY bigram', bigrams).fetchall())
+            if len(counts) < len(bigrams):
+                return []
+            books: Optional[Set[int]] = None
+            occurrences: Dict[str, Dict[int, Set[int]]] = {}
+            for bigram in sorted(bigrams, key=counts.get):
+                found: Dict[int, Set[int]] = {}
+                for book, blocks in conn.execute('SELECT book, blocks FROM postings WHERE bigram = ?', (bigram,)):
+                    if books is None or book in books:
+                        found.setdefault(book, set()).update(array('I', blocks))
+                occurrences[bigram] = found
+                books = set(found) if books is None else books & set(found)
+                if not books:
+                    return []
+            rows = conn.execute(f'SELECT id, path, encoding, size, mtime, block_bytes FROM books '
+                                f'WHERE id IN ({",".join("?" * len(books))}) AND complete = 1 ORDER BY path',
+                                list(books)).fetchall()
+
+            hits = []
+            missing = []
+            first = query[:2]
+            for book, path, encoding, size, mtime, block_bytes in rows:
+                # 查询词从块 b 开始时，其中每个两字都在块 b 或 b + 1 中，第一个两字在块 b 中
+                candidates = set(occurrences[first][book])
+                for bigram in bigrams:
+                    blocks = occurrences[bigram][book]
+                    candidates &= blocks | {block - 1 for block in blocks}
+                if not candidates:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # 文件已删除或改名，索引不再有用
+                    missing.append(book)
+                    continue
+                except OSError:
+                    continue
+                if stat.st_size != size or stat.st_mtime_ns != mtime:
+                    continue
+                hits.extend(self._verify(path, encoding, array('q', block_bytes), sorted(candidates),
+                                         query, min(per_book, limit - len(hits))))
+                if len(hits) >= limit:
+                    break
+            if missing:
+                try:
+                    self._remove_books(conn, missing)
+                except sqlite3.Error as e:
+                    print(f"删除书库索引失败: {e}")
+        finally:
+            conn.close()
+        return hits
+
+    @staticmethod
+    def _verify(path: str, encoding: str, block_bytes: array, candidates: List[int],
+                query: str, limit: int) -> List[SearchHit]:
+        """读取候选块核对查询词，返回实际命中的位置"""
+        try:
+            codec, _ = without_bom(encoding)
+            hits = []
+            name = os.path.basename(path)
+            lastBlock = len(block_bytes) - 2
+            with open(path, 'rb') as f:
+                for block in candidates:
+                    # 连同下一块一起解码，跨块的命中也能找到
+                    f.seek(block_bytes[block])
+                    data = f.read(block_bytes[min(block + 2, lastBlock + 1)] - block_bytes[block])
+                    text = normalize(data.decode(codec, errors='replace'))
+                    blockLength = min(BLOCK_SIZE, len(text))
+                    pos = text.find(query)
+                    while pos != -1 and pos < blockLength:
+                        hits.append(SearchHit(path, name, block * BLOCK_SIZE + pos, snippet(text, pos, len(query))))
+                        if len(hits) >= limit:
+                            return hits
+                        pos = text.find(query, pos + 1)
+            return hits
+        except OSError:
+            return []
+
+
+libraryIndex = LibraryIndex()
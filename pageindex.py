@@ -0,0 +1,119 @@
+import threading
+from array import array
+from bisect import bisect_right
+from typing import Callable, Optional
+
+
+class PageIndex:
+    def __init__(self, layout: Callable[[int], int], length: int):
+        """全书分页索引，记录每一页起始位置的字符偏移
+
+        Args:
+            layout: 排版函数，传入页起始偏移，返回下一页的起始偏移
+            length: 文本总长度
+        """
+        self.layout = layout
+        self.length = length
+        # 使用紧凑的 64 位整数数组保存页起始偏移，offsets[i] 即第 i 页
+        self.offsets = array('q')
+        # 下一个待验证页的起始偏移
+        self.frontier = 0
+        self.complete = length == 0
+        # 后台分页线程与界面线程共同扩展索引
+        self.lock = threading.Lock()
+
+    @property
+    def page_count(self) -> int:
+        """已建立索引的页数，索引完成后即为全书总页数"""
+        return len(self.offsets)
+
+    def extend(self, count: int = 1) -> int:
+        """继续向后排版 count 页
+
+        Returns:
+            实际新增的页数
+        """
+        added = 0
+        with self.lock:
+            while added < count and not self.complete:
+                mark = self.frontier
+                nextMark = self.layout(mark) if mark < self.length else mark
+                # 没有前进说明已经到达文本末尾
+                if nextMark <= mark:
+                    self.complete = True
+                    break
+                self.offsets.append(mark)
+                self.frontier = nextMark
+                added += 1
+        return added
+
+    def restore(self, offsets: array, frontier: int, complete: bool) -> None:
+        """从已保存的数据恢复索引"""
+        with self.lock:
+            self.offsets = offsets
+            self.frontier = frontier
+            self.complete = complete
+
+    def progress(self) -> int:
+        """已排版文本占全文的千分比"""
+        if self.complete or self.length == 0:
+            return 1000
+        return min(999, self.frontier * 1000 // self.length)
+
+    def ensure(self, page: int) -> bool:
+        """确保第 page 页已建立索引
+
+        Returns:
+            该页是否存在
+        """
+        if page < 0:
+            return False
+        if page >= len(self.offsets):
+            self.extend(page + 1 - len(self.offsets))
+        return page < len(self.offsets)
+
+    def build(self) -> None:
+        """排版全书，建立完整索引"""
+        while not self.complete:
+            self.extend(1024)
+
+    def offset(self, page: int) -> Optional[int]:
+        """获取第 page 页的起始偏移，页不存在时返回 None"""
+        if not self.ensure(page):
+            return None
+        return self.offsets[page]
+
+    def lookup(self, offset: int) -> Optional[int]:
+        """在已建立的索引中查找以 offset 为起始位置的页，不会触发排版"""
+        page = bisect_right(self.offsets, offset) - 1
+        if page >= 0 and self.offsets[page] == offset:
+            return page
+        return None
+
+    def covers(self, offset: int) -> bool:
+        """已建立的索引是否覆盖字符偏移 offset，覆盖时 page_of 不会触发排版"""
+        return self.complete or offset < self.frontier
+
+    def estimate_offset(self, page: int) -> int:
+        """按已建立部分的平均每页字数估计第 page 页的起始偏移，只用于尚未分页的部分"""
+        if not self.offsets:
+            return 0
+        return min(self.length, self.frontier * page // len(self.offsets))
+
+    def page_of(self, offset: int) -> int:
+        """获取包含字符偏移 offset 的页码，索引尚未覆盖 offset 时会排版到该位置为止"""
+        while not self.complete and offset >= self.frontier:
+            self.extend(1024)
+        return max(0, bisect_right(self.offsets, offset) - 1)
+
+    def page_of_percent(self, percent: float) -> int:
+        """获取全书百分比位置对应的页码
+
+        索引完整时按总页数计算；尚未完成时按字符位置换算，只排版到该位置为止
+        """
+        percent = min(max(percent, 0.0), 100.0)
+        if not self.complete:
+            return self.page_of(int(self.length * percent / 100))
+        if not self.offsets:
+            return 0
+        return min(int(len(self.offsets) * percent / 100), len(self.offsets) - 1)
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+
+from PySide6.QtCore import Qt, QPointF, QRect, QSize
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QImage, QPainter, QPixmap, QRegion, QStaticText, \
+    QTransform
+
+
+class PageRenderer:
+    def __init__(self, maxPages: int = 1):
+        """缓存已排版页面的绘制结果
+
+        每页先用 QStaticText 绘制一张与颜色无关的透明度蒙版，再按颜色合成为 QPixmap。
+        同一页在相同字体、尺寸、行距和颜色下重复绘制时直接返回缓存的图像；
+        鼠标移入移出只改变颜色，只需用已有的蒙版做一次合成。
+
+        Args:
+            maxPages: 最多缓存的页数
+        """
+        self.maxPages = maxPages
+        self.styleKey = None
+        # (文本, 尺寸) -> 蒙版
+        self.masks = OrderedDict()
+        # (文本, 尺寸, 颜色) -> 合成后的图像
+        self.frames = OrderedDict()
+
+    def setStyle(self, font: QFont, lineSpacing: int, devicePixelRatio: float) -> bool:
+        """设置绘制样式，样式变化时清空所有缓存
+
+        Returns:
+            样式是否发生了变化
+        """
+        key = (font.key(), lineSpacing, devicePixelRatio)
+        if key == self.styleKey:
+            return False
+        self.styleKey = key
+        self.font = QFont(font)
+        self.metrics = QFontMetrics(self.font)
+        self.lineSpacing = lineSpacing
+        self.devicePixelRatio = devicePixelRatio
+        self.invalidate()
+        return True
+
+    def invalidate(self):
+        self.masks.clear()
+        self.frames.clear()
+
+    def damage(self, oldText: str, newText: str, size: QSize) -> QRegion:
+        """计算从 oldText 换成 newText 时需要重绘的区域，只包含内容不同的行"""
+        if self.styleKey is None:
+            return QRegion(QRect(0, 0, size.width(), size.height()))
+        lineHeight = self.metrics.height() + self.lineSpacing
+        oldLines = oldText.split('\n')
+        newLines = newText.split('\n')
+        region = QRegion()
+        for i in range(max(len(oldLines), len(newLines))):
+            old = oldLines[i] if i < len(oldLines) else ''
+            new = newLines[i] if i < len(newLines) else ''
+            if old == new:
+                continue
+            # 多算一个字宽，覆盖斜体和抗锯齿超出的部分
+            width = max(self.metrics.horizontalAdvance(old), self.metrics.horizontalAdvance(new)) \
+                + self.metrics.maxWidth()
+            region += QRect(0, i * lineHeight, min(width, size.width()), self.metrics.height())
+        return region
+
+    def mask(self, text: str, size: QSize) -> QImage:
+        """获取页面的透明度蒙版，文字为不透明白色"""
+        key = (text, size.width(), size.height())
+        image = self.masks.get(key)
+        if image is not None:
+            self.masks.move_to_end(key)
+            return image
+
+        ratio = self.devicePixelRatio
+        image = QImage(size * ratio, QImage.Format.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(ratio)
+        image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        painter.setFont(self.font)
+        painter.setPen(QColor(255, 255, 255))
+        lineHeight = self.metrics.height() + self.lineSpacing
+        y = 0
+        for line in text.split('\n'):
+            if line:
+                staticText = QStaticText(line)
+                staticText.setTextFormat(Qt.TextFormat.PlainText)
+                staticText.prepare(QTransform(), self.font)
+                painter.drawStaticText(QPointF(0, y), staticText)
+            y += lineHeight
+        painter.end()
+
+        self.masks[key] = image
+        while len(self.masks) > self.maxPages:
+            self.masks.popitem(last=False)
+        return image
+
+    def frame(self, text: str, size: QSize, color: QColor) -> QPixmap:
+        """获取按指定颜色合成的页面图像"""
+        key = (text, size.width(), size.height(), color.rgba())
+        pixmap = self.frames.get(key)
+        if pixmap is not None:
+            self.frames.move_to_end(key)
+            return pixmap
+
+        mask = self.mask(text, size)
+        image = QImage(mask.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(self.devicePixelRatio)
+        image.fill(color)
+        painter = QPainter(image)
+        # 用蒙版的透明度裁出文字
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationIn)
+        painter.drawImage(0, 0, mask)
+        # 绘制一个几乎透明的背景，以便接收鼠标事件
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationOver)
+        painter.fillRect(image.rect(), QColor(0, 0, 0, 1))
+        painter.end()
+
+        pixmap = QPixmap.fromImage(image)
+        self.frames[key] = pixmap
+        # 每页通常有移入、移出两种颜色
+        while len(self.frames) > self.maxPages * 2:
+            self.frames.popitem(last=False)
+        return pixmap
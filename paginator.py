@@ -0,0 +1,92 @@
+from PySide6.QtCore import QThread, Signal
+
+import perf
+from libraryindex import libraryIndex
+from pageindex import PageIndex
+from searchindex import BigramIndex
+
+
+class PaginationWorker(QThread):
+    # 已索引页数，进度（千分比）
+    progress = Signal(int, int)
+    # 全书分页完成，参数为总页数
+    completed = Signal(int)
+
+    def __init__(self, pageIndex: PageIndex, chunkSize: int = 256, parent=None):
+        """在后台线程中分块建立全书分页索引
+
+        Args:
+            pageIndex: 需要补全的分页索引，与界面线程共享
+            chunkSize: 每次加锁排版的页数，越小界面线程等待越短
+        """
+        super().__init__(parent)
+        self.pageIndex = pageIndex
+        self.chunkSize = chunkSize
+
+    def run(self):
+        index = self.pageIndex
+        while not index.complete:
+            if self.isInterruptionRequested():
+                return
+            with perf.span('paginate'):
+                index.extend(self.chunkSize)
+            self.progress.emit(index.page_count, index.progress())
+        self.completed.emit(index.page_count)
+
+    def cancel(self):
+        """取消分页并等待线程退出"""
+        self.requestInterruption()
+        self.wait()
+
+
+class SearchIndexWorker(QThread):
+    # 全文索引建立完成
+    completed = Signal()
+    # 全文过长，不建立索引
+    skipped = Signal()
+
+    def __init__(self, searchIndex: BigramIndex, parent=None):
+        """在后台线程中建立全文搜索索引"""
+        super().__init__(parent)
+        self.searchIndex = searchIndex
+
+    def run(self):
+        with perf.span('search_index'):
+            built = self.searchIndex.build(self.isInterruptionRequested)
+        if built:
+            self.completed.emit()
+        elif self.searchIndex.skipped:
+            self.skipped.emit()
+
+    def cancel(self):
+        """取消建立索引并等待线程退出"""
+        self.requestInterruption()
+        self.wait()
+
+
+class LibraryIndexWorker(QThread):
+    # 书库索引更新完成
+    completed = Signal()
+
+    def __init__(self, filePath: str, fingerprint: str, text, encoding: str, parent=None):
+        """在后台线程中把一本书加入书库搜索索引"""
+        super().__init__(parent)
+        self.filePath = filePath
+        self.fingerprint = fingerprint
+        self.text = text
+        self.encoding = encoding
+
+    def run(self):
+        try:
+            updated = libraryIndex.add_book(self.filePath, self.fingerprint, self.text, self.encoding,
+                                            self.isInterruptionRequested)
+        except OSError as e:
+            print(f"更新书库索引失败: {e}")
+            return
+        if updated:
+            self.completed.emit()
+
+    def cancel(self):
+        """取消更新并等待线程退出，已有的索引保持不变"""
+        self.requestInterruption()
+        self.wait()
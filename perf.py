@@ -0,0 +1,158 @@
+import atexit
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, TextIO
+
+# 设置环境变量 READER_PERF=1 或使用 --perf 启动参数时记录耗时，检查启动耗时的参数也会开启
+_enabled = (os.environ.get('READER_PERF', '0') not in ('', '0')
+            or any(arg in sys.argv for arg in ('--perf', '--startup-report', '--startup-budget')))
+# 每项最多保留的样本数，超出后只保留最近的样本
+MAX_SAMPLES = 100000
+
+_samples: Dict[str, List[float]] = {}
+# 本模块被导入的时间，启动脚本最先导入本模块，作为启动耗时的起点
+_origin = time.perf_counter()
+_lock = threading.Lock()
+_hooked = False
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(on: bool = True) -> None:
+    """开启或关闭耗时记录，开启时在退出时输出统计"""
+    global _enabled
+    _enabled = on
+    if on:
+        _install_hooks()
+
+
+def span(name: str):
+    """记录一段代码的耗时，用于 with 语句
+
+    未开启时返回共用的空对象，几乎没有开销。
+
+    Args:
+        name: 统计项名称，如 decode、paginate、flip
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name: str):
+    """装饰器，记录函数每次调用的耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def since_start() -> float:
+    """距离本模块被导入经过的秒数"""
+    return time.perf_counter() - _origin
+
+
+def milestone(name: str) -> None:
+    """记录启动过程中到达某一步时距离启动经过的时间"""
+    record(name, since_start())
+
+
+def record(name: str, seconds: float) -> None:
+    """记录一次耗时（秒）"""
+    if not _enabled:
+        return
+    with _lock:
+        samples = _samples.setdefault(name, [])
+        samples.append(seconds)
+        if len(samples) > MAX_SAMPLES:
+            del samples[:len(samples) - MAX_SAMPLES]
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """按统计项汇总次数、总耗时以及 p50、p95、最大值（毫秒）"""
+    with _lock:
+        snapshot = {name: sorted(samples) for name, samples in _samples.items() if samples}
+    result = {}
+    for name, samples in snapshot.items():
+        count = len(samples)
+        result[name] = {
+            'count': count,
+            'total': sum(samples) * 1000,
+            'p50': samples[count // 2] * 1000,
+            'p95': samples[min(count - 1, int(count * 0.95))] * 1000,
+            'max': samples[-1] * 1000,
+        }
+    return result
+
+
+def report(stream: Optional[TextIO] = None) -> None:
+    """输出耗时统计"""
+    stream = stream or sys.stderr
+    stats = summary()
+    if not stats:
+        return
+    stream.write("耗时统计:\n")
+    for name in sorted(stats):
+        item = stats[name]
+        stream.write(f"  {name}: {item['count']} 次, 总计 {item['total']:.2f} ms, p50 {item['p50']:.3f} ms, "
+                     f"p95 {item['p95']:.3f} ms, 最大 {item['max']:.3f} ms\n")
+    stream.flush()
+
+
+def reset() -> None:
+    with _lock:
+        _samples.clear()
+
+
+def _install_hooks() -> None:
+    """退出时输出统计，支持时收到 SIGUSR1 立即输出"""
+    global _hooked
+    if _hooked:
+        return
+    _hooked = True
+    atexit.register(report)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: report())
+
+
+if _enabled:
+    _install_hooks()
@@ -0,0 +1,109 @@
+from PySide6.QtCore import QObject, QTimer
+
+
+class PagePrefetcher(QObject):
+    def __init__(self, readWindow):
+        """预先排版并绘制当前页前后的若干页
+
+        每次翻页后在事件循环空闲时逐页补齐，每次只处理一页，不影响界面响应。
+        根据最近的翻页方向决定向前还是向后多准备几页，占用的图像内存不超过预算。
+        字体、颜色或排版变化时由阅读窗口调用 clear 丢弃所有结果。
+
+        Args:
+            readWindow: 所属的阅读窗口
+        """
+        super().__init__(readWindow)
+        self.readWindow = readWindow
+        self.nextCount = 3
+        self.prevCount = 1
+        self.budget = 32 * 1024 * 1024
+        # 起始偏移 -> (页文本, 下一页起始偏移)
+        self.pages = {}
+        # 大于 0 表示最近主要向后翻页
+        self.direction = 1.0
+        self.tasks = []
+        self.keep = set()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.fillOne)
+
+    def configure(self, nextCount: int, prevCount: int, budget: int):
+        """设置向后、向前预取的页数和内存预算（字节）"""
+        self.nextCount = max(0, nextCount)
+        self.prevCount = max(0, prevCount)
+        self.budget = max(0, budget)
+        self.clear()
+
+    def clear(self):
+        """丢弃所有预取结果"""
+        self.timer.stop()
+        self.pages.clear()
+        self.tasks = []
+        self.keep = set()
+
+    def page(self, anchor):
+        """获取已预先排版的页，没有时返回 None"""
+        return self.pages.get(anchor)
+
+    def layout(self, anchor):
+        """排版从 anchor 开始的一页并记录结果"""
+        page = self.pages.get(anchor)
+        if page is None:
+            page = self.readWindow.subText(anchor)
+            self.pages[anchor] = page
+        return page
+
+    def flipped(self, step: int = 0):
+        """翻页或跳转后调用，step 为翻页方向，跳转时为 0"""
+        if step:
+            self.direction = self.direction * 0.6 + (0.4 if step > 0 else -0.4)
+        self.refill()
+
+    def capacity(self) -> int:
+        """按内存预算计算最多可以预先绘制的页数"""
+        window = self.readWindow
+        ratio = window.devicePixelRatioF()
+        # 每页一张蒙版和一张合成后的图像
+        frameBytes = max(1, int(window.width() * window.height() * ratio * ratio * 4 * 2))
+        return self.budget // frameBytes
+
+    def refill(self):
+        """按当前位置重新安排预取任务"""
+        ahead, behind = self.nextCount, self.prevCount
+        if self.direction < 0:
+            ahead, behind = behind, ahead
+        capacity = self.capacity()
+        # 预算不足时优先保证阅读方向上的页
+        ahead = min(ahead, capacity)
+        behind = min(behind, max(0, capacity - ahead))
+        self.readWindow.pageRenderer.maxPages = ahead + behind + 1
+
+        window = self.readWindow
+        self.keep = {window.anchor}
+        self.pages[window.anchor] = (window.text, window.nextMark)
+        # 每个任务为 [方向, 当前页起始偏移, 剩余页数]
+        self.tasks = [task for task in ([1, window.anchor, ahead], [-1, window.anchor, behind]) if task[2] > 0]
+        self.timer.start()
+
+    def fillOne(self):
+        """准备一页，还有任务时继续安排到下一次事件循环"""
+        window = self.readWindow
+        while self.tasks:
+            task = self.tasks[0]
+            step, anchor, remaining = task
+            _, nextMark = self.layout(anchor)
+            neighbour = window.neighbourAnchor(step, anchor, nextMark)
+            if neighbour is None or remaining <= 0:
+                self.tasks.pop(0)
+                continue
+            text, _ = self.layout(neighbour)
+            self.keep.add(neighbour)
+            # 预先绘制当前颜色下的页面
+            window.prepareFrame(text)
+            task[1] = neighbour
+            task[2] = remaining - 1
+            self.timer.start()
+            return
+        # 全部完成后丢弃不在当前窗口内的页
+        self.pages = {anchor: page for anchor, page in self.pages.items() if anchor in self.keep}
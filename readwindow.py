@@ -1,68 +1,44 @@
-import re
 import time
 import os
-import json
-from datetime import datetime
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QListWidget, QListWidgetItem, QLineEdit, QPushButton, QHBoxLayout
-from PySide6.QtWidgets import QLabel  # 移除进度对话框相关组件
-from PySide6.QtCore import Qt, QPoint, QSize  # 移除不需要的导入
-from PySide6.QtGui import QMouseEvent, QGuiApplication, QPainter, QPen, QColor, QFontMetrics, \
-    QKeySequence, QShortcut, QAction, QIcon, QPixmap
-from settingdata import settingData
+from PySide6.QtWidgets import QLabel, QInputDialog  # 移除进度对话框相关组件
+from PySide6.QtCore import Qt, QPoint, QSize, QTimer, Signal
+from PySide6.QtGui import QMouseEvent, QGuiApplication, QPainter, QPen, QColor, QFontMetrics, QFontMetricsF, \
+    QKeySequence, QShortcut, QAction
+import perf
+from settingdata import SettingChange, settingData
+from pageindex import PageIndex
+from textlayout import GlyphLayout, TextLayout, width_table
+from libraryindex import libraryIndex
+from paginator import LibraryIndexWorker, PaginationWorker, SearchIndexWorker
+from searchindex import MAX_INDEX_LENGTH, BigramIndex, snippet
+from bookcache import pageCache, tocCache
+from filecache import contentCache
+from pagerender import PageRenderer
+from prefetch import PagePrefetcher
+from textcontent import TextContent
+from history import get_most_recent_file, historyStore
 
 
-# 支持的编码格式
 def readText(fileName):
-    # 读取文本
+    # 读取文本，返回共用内容缓存中的条目，包含文本内容、使用的编码和文件指纹
     if settingData.filePath != fileName:
-        settingData.currentPage = 0
-        settingData.lastPage = 0
-        settingData.pages = [0] * settingData.pageSize
+        settingData.anchor = 0
     settingData.filePath = fileName
 
-    encodings = ['utf-8', 'Windows-1252', 'ANSI', 'gbk', 'ISO-8859-1', 'big5']  # 增加其他编码格式
-    # 尝试每种编码格式
-    for encoding in encodings:
+    try:
+        return contentCache.load(fileName)
+    except FileNotFoundError:
+        # 如果文件不存在，尝试从历史记录中找到最近的文件
         try:
-            with open(fileName, 'r', encoding=encoding) as file:
-                text = file.read()
-                return text
-        except (UnicodeDecodeError, LookupError):
-            pass
-        except FileNotFoundError:
-            # 如果文件不存在，尝试从历史记录中找到最近的文件
-            try:
-                recent_file = get_most_recent_file()
-                if recent_file and os.path.exists(recent_file):
-                    settingData.filePath = recent_file
-                    return readText(recent_file)
-                else:
-                    raise IOError(f"文件 {fileName} 不存在，且没有可用的历史记录")
-            except Exception as e:
-                raise IOError(f"文件 {fileName} 不存在: {str(e)}")
-
-    # 如果所有编码都失败，抛出异常
-    raise IOError(f"Could not decode the file {fileName} with any of the encodings: {encodings}")
-
-
-def get_most_recent_file():
-    """获取最近打开的文件"""
-    history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
-
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-
-            # 遍历历史记录，找到第一个存在的文件
-            for item in history:
-                file_path = item['path']
-                if os.path.exists(file_path):
-                    return file_path
-        except Exception:
-            pass
-
-    return None
+            recent_file = get_most_recent_file()
+            if recent_file and os.path.exists(recent_file):
+                settingData.filePath = recent_file
+                return readText(recent_file)
+            else:
+                raise IOError(f"文件 {fileName} 不存在，且没有可用的历史记录")
+        except Exception as e:
+            raise IOError(f"文件 {fileName} 不存在: {str(e)}")
 
 
 def open_last_file():
@@ -71,7 +47,7 @@ def open_last_file():
     last_file = settingData.filePath
 
     # 确保设置数据已加载
-    if not last_file or last_file == "":
+    if not settingData.loaded:
         settingData.readData()
         last_file = settingData.filePath
 
@@ -94,6 +70,20 @@ def open_last_file():
     return recent_file
 
 
+# 从历史记录中打开的窗口，保留引用避免被回收
+openWindows = []
+
+
+def createReadWindow(fileName):
+    """创建并显示阅读窗口"""
+    # 丢弃已关闭的窗口
+    openWindows[:] = [window for window in openWindows if window.isVisible()]
+    window = ReadWindow(fileName)
+    window.show()
+    openWindows.append(window)
+    return window
+
+
 class ReadWindow(QWidget):
     def __init__(self, fileName=None):
         super().__init__()
@@ -111,10 +101,30 @@ class ReadWindow(QWidget):
 
         # 添加文件到历史记录
         self.addToHistory(fileName)
+        self.paginationWorker = None
+        # 全文搜索索引，第一次搜索时在后台建立
+        self.searchIndex = None
+        self.searchWorker = None
+        self.libraryWorker = None
+        # 翻页开始的时间，用于记录翻页到画面更新完成的耗时
+        self.flipStarted = None
+        # 页面绘制缓存与前后页预取
+        self.pageRenderer = PageRenderer()
+        self.prefetcher = PagePrefetcher(self)
+        self.prefetcher.configure(settingData.prefetchNext, settingData.prefetchPrev,
+                                  settingData.prefetchBudget * 1024 * 1024)
 
         try:
-            self.textContent = readText(fileName)
-            self.text, _ = self.rollPage(settingData.currentPage)
+            content = readText(fileName)
+            self.content = content
+            self.textContent, self.encoding = content.text, content.encoding
+            self.filePath = settingData.filePath
+            self.fingerprint = content.derived['fingerprint']
+            self.chapters = content.derive('chapters', lambda: tocCache.get_chapters(
+                self.filePath, self.fingerprint, self.textContent, self.encoding))
+            self.resetPageIndex()
+            # 直接从保存的阅读位置排版当前页，不需要从头分页
+            self.text, _ = self.layoutAt(self.resumeAnchor())
         except Exception as e:
             from PySide6.QtWidgets import QMessageBox
             QMessageBox.critical(None, "错误", f"无法读取文件: {str(e)}")
@@ -125,20 +135,33 @@ class ReadWindow(QWidget):
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint)
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
 
-        # 添加一个标志来跟踪是否需要完全重绘
-        self.needFullRepaint = True
 
         # 添加大小调整相关变量
         self.resizing = False
         self.resizeDirection = None
         self.resizeMargin = 10  # 边缘调整大小的区域宽度
+        # 拖动调整大小时按屏幕刷新率合并几何变化，松开鼠标后才重新排版
+        self.pendingGeometry = None
+        self.geometryTimer = QTimer(self)
+        self.geometryTimer.setSingleShot(True)
+        self.geometryTimer.setInterval(max(1, int(1000 / (self.screen().refreshRate() or 60))))
+        self.geometryTimer.timeout.connect(self.applyPendingGeometry)
+        # 最近一次完整绘制的页面，调整大小过程中裁剪显示
+        self.lastFrame = None
 
         self.selectChapter = QAction('选择章节')
+        self.jumpPage = QAction('跳转页码')
         self.closeSelf = QAction('关闭')
         self.history = QAction('历史记录')
+        self.search = QAction('搜索')
+        self.searchLibrary = QAction('搜索书库')
+        self.browse = QAction('全文浏览')
         self.setAction()
         self.scrollableMenu = None
         self.historyMenu = None
+        self.searchMenu = None
+        self.librarySearchMenu = None
+        self.fullTextView = None
 
         self.qPen = QPen(settingData.qColor)
 
@@ -149,55 +172,57 @@ class ReadWindow(QWidget):
         # 添加快捷键
         self.next = QShortcut(QKeySequence(settingData.nextShortCut), self)
         self.last = QShortcut(QKeySequence(settingData.lastShortCut), self)
-        self.next.activated.connect(lambda: self.rollPageActive(settingData.currentPage + 1))
-        self.last.activated.connect(lambda: self.rollPageActive(settingData.currentPage - 1))
+        self.next.activated.connect(lambda: self.flipPage(1))
+        self.last.activated.connect(lambda: self.flipPage(-1))
+        self.searchShortcut = QShortcut(QKeySequence(QKeySequence.StandardKey.Find), self)
+        self.searchShortcut.activated.connect(self.displaySearch)
+
+        # 设置修改后立即生效，不需要重新打开窗口
+        settingData.changed.connect(self.onSettingChanged)
+
+        # 窗口显示后开始预取当前页前后的页
+        QTimer.singleShot(0, self.prefetcher.refill)
+        # 内容有变化的书在后台加入书库搜索索引
+        QTimer.singleShot(0, self.updateLibraryIndex)
+
+    def prepareFrame(self, text):
+        """获取页面在当前样式和颜色下的图像，样式变化时丢弃预取的页"""
+        if self.pageRenderer.setStyle(settingData.qFont, settingData.lineSpacing, self.devicePixelRatioF()):
+            self.prefetcher.clear()
+        return self.pageRenderer.frame(text, self.size(), self.qPen.color())
 
     def paintEvent(self, event):
-        # 创建一个全新的QPixmap作为绘制表面
-        pixmap = QPixmap(self.size())
-        # 使pixmap完全透明
-        pixmap.fill(Qt.GlobalColor.transparent)
-
-        # 在pixmap上创建一个新的painter
-        temp_painter = QPainter(pixmap)
-        temp_painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        temp_painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-
-        # 设置字体和画笔
-        temp_painter.setFont(settingData.qFont)
-        temp_painter.setPen(self.qPen)
-
-        # 绘制一个几乎透明的背景，以便接收鼠标事件
-        temp_painter.fillRect(self.rect(), QColor(0, 0, 0, 1))
-
-        # 绘制文本
-        textLines = self.text.split('\n')
-        metrics = QFontMetrics(settingData.qFont)
-        yPosition = metrics.ascent()
-        for line in textLines:
-            temp_painter.drawText(QPoint(0, yPosition), line)
-            yPosition += metrics.height() + settingData.lineSpacing
-
-        # 完成pixmap上的绘制
-        temp_painter.end()
-
-        # 现在将pixmap绘制到窗口上
-        window_painter = QPainter(self)
-
-        # 如果需要完全重绘，先清除整个窗口
-        if self.needFullRepaint:
-            window_painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
-            window_painter.fillRect(self.rect(), Qt.GlobalColor.transparent)
-            window_painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-            self.needFullRepaint = False
-
-        window_painter.drawPixmap(0, 0, pixmap)
+        with perf.span('paint'):
+            self.paintPage()
+        if self.flipStarted is not None:
+            perf.record('flip_latency', time.perf_counter() - self.flipStarted)
+            self.flipStarted = None
+
+    def paintPage(self):
+        painter = QPainter(self)
+        # 直接替换窗口内容，透明区域同样覆盖上一页
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        if self.resizing and self.lastFrame is not None:
+            # 拖动调整大小时不重新排版，按新尺寸裁剪上一帧
+            painter.fillRect(self.rect(), QColor(0, 0, 0, 1))
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+            painter.drawPixmap(0, 0, self.lastFrame)
+        else:
+            # 同一页在字体、尺寸和颜色不变时直接使用缓存的图像
+            self.lastFrame = self.prepareFrame(self.text)
+            painter.drawPixmap(0, 0, self.lastFrame)
+        painter.end()
 
-    def initUI(self):
-        # 计算文本高度和宽度
+    def textSize(self):
+        """按字体、每行字数、行数和行间距计算正好容纳一页的窗口大小"""
         fontMetrics = QFontMetrics(settingData.qFont)
         textWidth = fontMetrics.horizontalAdvance('中') * settingData.lineSize
         textHeight = (fontMetrics.height() + settingData.lineSpacing) * settingData.textLine - settingData.lineSpacing
+        return textWidth, textHeight
+
+    def initUI(self):
+        # 计算文本高度和宽度
+        textWidth, textHeight = self.textSize()
         # 获取主屏幕
         screen = QGuiApplication.primaryScreen()
         # 获取屏幕的尺寸
@@ -211,55 +236,120 @@ class ReadWindow(QWidget):
 
     # 根据mark来移动标记的指针，正向
     def subText(self, mark):
-        count = 0
-        line = 0
-        string = ""
-        for i in range(mark, len(self.textContent)):
-            char = self.textContent[i]
-            # 将多个换行符作为一个换行符进行拼接
-            if char == '\n':
-                try:
-                    if self.textContent[i + 1] != '\n':
-                        # 如果下一个字符不是换行符，拼接
-                        string += char
-                        count = 0
-                        line += 1
-                # 可能到最后一个字符
-                except IndexError:
-                    string += char
-                    break
-            else:
-                string += char
-                count += 1
-                if count >= settingData.lineSize:
-                    string += '\n'
-                    count = 0
-                    line += 1
-            mark += 1
-            if line >= settingData.textLine:
-                break
-        return string, mark
+        return self.textLayout.render(self.textContent, mark)
+
+    def createTextLayout(self):
+        """按设置创建排版引擎"""
+        if settingData.wrapMode != 'glyph':
+            return TextLayout(settingData.lineSize, settingData.textLine)
+        # 按字符实际宽度折行，行宽与 initUI 计算的窗口宽度一致
+        font = settingData.qFont
+        metrics = QFontMetricsF(font)
+        widths = width_table(font.key(), metrics.horizontalAdvance)
+        return GlyphLayout(font.key(), widths, widths['中'] * settingData.lineSize, settingData.textLine)
+
+    def resetPageIndex(self):
+        """按当前排版重新建立分页索引"""
+        self.stopPagination()
+        self.prefetcher.clear()
+        textLayout = self.createTextLayout()
+        textContent = self.textContent
+        self.textLayout = textLayout
+        self.pageIndex = PageIndex(lambda mark: textLayout.next_mark(textContent, mark), len(textContent))
+        # 排版未变的书直接使用磁盘缓存中的索引
+        pageCache.load(self.filePath, self.fingerprint, textLayout.key, self.pageIndex)
+        if self.pageIndex.complete:
+            self.setToolTip(f"共 {self.pageIndex.page_count} 页")
+            return
+        # 在后台线程中补全索引，界面线程随时可以使用已建立的部分
+        self.paginationWorker = PaginationWorker(self.pageIndex, parent=self)
+        self.paginationWorker.progress.connect(self.onPaginationProgress)
+        self.paginationWorker.completed.connect(self.onPaginationCompleted)
+        self.paginationWorker.start(PaginationWorker.Priority.LowPriority)
+
+    def stopPagination(self):
+        """取消正在进行的后台分页，并保存已完成的部分"""
+        if self.paginationWorker is not None:
+            self.paginationWorker.progress.disconnect(self.onPaginationProgress)
+            self.paginationWorker.completed.disconnect(self.onPaginationCompleted)
+            self.paginationWorker.cancel()
+            self.paginationWorker.deleteLater()
+            self.paginationWorker = None
+            pageCache.save(self.filePath, self.fingerprint, self.textLayout.key, self.pageIndex)
+
+    def onPaginationProgress(self, pages, permille):
+        # 忽略已取消的分页线程在取消前发出的信号
+        if self.paginationWorker is None or self.sender() is not self.paginationWorker:
+            return
+        self.setToolTip(f"正在分页: {permille / 10:.1f}% ({pages} 页)")
+
+    def onPaginationCompleted(self, pages):
+        if self.paginationWorker is None or self.sender() is not self.paginationWorker:
+            return
+        self.setToolTip(f"共 {pages} 页")
+        pageCache.save(self.filePath, self.fingerprint, self.textLayout.key, self.pageIndex)
+
+    @perf.timed('layout')
+    def layoutAt(self, anchor):
+        """从字符位置 anchor 开始排版一页，并将其作为当前阅读位置"""
+        page = self.prefetcher.page(anchor)
+        text, nextMark = page if page is not None else self.subText(anchor)
+        self.anchor = anchor
+        self.nextMark = nextMark
+        settingData.anchor = anchor
+        historyStore.set_position(self.fingerprint, anchor, self.textLayout.key)
+        return text, nextMark
+
+    def resumeAnchor(self):
+        """获取这本书上次的阅读位置
+
+        按内容指纹查找，改名或移动过的文件也能回到原来的位置，没有记录时使用设置中的位置。
+        """
+        position = historyStore.position(self.fingerprint)
+        if position is not None and position['layout'] == self.textLayout.key:
+            # 内容和排版都没有变，保存的位置一定是有效的页首
+            return position['anchor']
+        anchor = position['anchor'] if position is not None else settingData.anchor
+        return anchor if self.hasPage(anchor) else 0
+
+    def hasPage(self, mark):
+        """从 mark 开始是否还有一页内容"""
+        return 0 <= mark < len(self.textContent) and self.textLayout.next_mark(self.textContent, mark) > mark
 
     # 翻页功能，查找并处理文本
     def rollPage(self, page):
-        if page < 0:
+        offset = self.pageIndex.offset(page)
+        if offset is None:
             return None, None
-        pageOffset = page - settingData.lastPage
-        if pageOffset >= 0:
-            text, nextMark = self.subText(settingData.pages[page % settingData.pageSize])
-            if len(text) == 0:
-                return None, None
-            settingData.currentPage = page
-            settingData.pages[(page + 1) % settingData.pageSize] = nextMark
-            settingData.lastPage += 1
-            return text, nextMark
-        else:
-            if -pageOffset < settingData.pageSize:
-                settingData.currentPage = page
-                text, nextMark = self.subText(settingData.pages[page % settingData.pageSize])
-                return text, nextMark
-            else:
-                return None, None
+        return self.layoutAt(offset)
+
+    def neighbourAnchor(self, step, anchor=None, nextMark=None):
+        """获取下一页（step > 0）或上一页（step < 0）的起始位置，没有时返回 None
+
+        默认相对于当前页，也可以传入其他页的起始位置和下一页位置
+        """
+        if anchor is None:
+            anchor, nextMark = self.anchor, self.nextMark
+        if step > 0:
+            return nextMark if self.hasPage(nextMark) else None
+        if anchor <= 0:
+            return None
+        page = self.pageIndex.lookup(anchor)
+        if page is not None:
+            # 当前页与分页索引对齐
+            return self.pageIndex.offsets[page - 1]
+        if self.pageIndex.frontier > anchor:
+            # 重排后当前页与索引不对齐，回到索引中包含当前位置的页，重新对齐
+            return self.pageIndex.offsets[self.pageIndex.page_of(anchor)]
+        # 索引尚未覆盖当前位置时只在附近局部排版
+        return self.textLayout.previous_mark(self.textContent, anchor)
+
+    def flipPage(self, step):
+        """向后或向前翻一页"""
+        with perf.span('flip'):
+            anchor = self.neighbourAnchor(step)
+            if anchor is not None:
+                self.showAnchor(anchor, step)
 
     def nativeEvent(self, eventType, message):
         # 处理Windows系统的WM_NCHITTEST消息，以允许拖拽
@@ -276,16 +366,133 @@ class ReadWindow(QWidget):
     def setAction(self):
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.ActionsContextMenu)
         self.addAction(self.selectChapter)
+        self.addAction(self.jumpPage)
         self.addAction(self.history)
+        self.addAction(self.search)
+        self.addAction(self.searchLibrary)
+        self.addAction(self.browse)
         self.addAction(self.closeSelf)
         self.selectChapter.triggered.connect(self.displayChapter)
+        self.jumpPage.triggered.connect(self.displayJump)
         self.history.triggered.connect(self.displayHistory)
+        self.search.triggered.connect(self.displaySearch)
+        self.searchLibrary.triggered.connect(self.displayLibrarySearch)
+        self.browse.triggered.connect(self.displayFullText)
         self.closeSelf.triggered.connect(self.close)
 
     def displayChapter(self):
         self.scrollableMenu = ScrollableMenu(self)
         self.scrollableMenu.show()
 
+    def displayFullText(self):
+        """在可滚动的窗口中浏览全文，从当前页开始，双击某一行跳转到该行所在的页"""
+        if self.fullTextView is None:
+            self.fullTextView = TextContent(self.filePath, settingData.qFont)
+            self.fullTextView.setWindowTitle(os.path.basename(self.filePath))
+            self.fullTextView.offsetActivated.connect(self.jumpToOffset)
+            self.fullTextView.resize(600, 800)
+        self.fullTextView.scrollToOffset(self.anchor)
+        self.fullTextView.updateScrollBar()
+        self.fullTextView.show()
+        self.fullTextView.activateWindow()
+
+    def displayJump(self):
+        """输入页码或百分比进行跳转"""
+        if self.pageIndex.complete:
+            hint = f'输入页码(1-{self.pageIndex.page_count})或百分比(如 50%):'
+        else:
+            hint = f'输入页码(已分页 {self.pageIndex.page_count} 页)或百分比(如 50%):'
+        value, ok = QInputDialog.getText(self, '跳转页码', hint)
+        value = value.strip()
+        if not ok or not value:
+            return
+        try:
+            if value.endswith('%'):
+                self.jumpToPercent(float(value[:-1]))
+            else:
+                self.jumpToPage(int(value) - 1)
+        except ValueError:
+            pass
+
+    def jumpToPage(self, page):
+        """跳转到指定页"""
+        page = max(page, 0)
+        if not self.pageIndex.complete and page >= self.pageIndex.page_count:
+            # 超出已分页的部分时按平均每页字数估计位置，页码在后台分页追上之前只是估计值
+            self.jumpToOffset(self.pageIndex.estimate_offset(page))
+            return
+        if not self.pageIndex.ensure(page):
+            page = max(self.pageIndex.page_count - 1, 0)
+        self.rollPageActive(page)
+
+    def jumpToPercent(self, percent):
+        """跳转到全书百分比位置"""
+        if self.pageIndex.complete:
+            self.rollPageActive(self.pageIndex.page_of_percent(percent))
+        else:
+            percent = min(max(percent, 0.0), 100.0)
+            self.jumpToOffset(int(len(self.textContent) * percent / 100))
+
+    def displaySearch(self):
+        """显示搜索窗口，同时开始建立全文索引"""
+        self.ensureSearchIndex()
+        if self.searchMenu is None:
+            self.searchMenu = SearchMenu(self)
+        self.searchMenu.show()
+        self.searchMenu.activateWindow()
+
+    def ensureSearchIndex(self):
+        """在后台建立全文索引，建好后保存在内容缓存中，同一本书只建立一次"""
+        if self.searchIndex is not None:
+            return
+        cached = self.content.derived.get('search')
+        if cached is not None:
+            self.searchIndex = cached
+            return
+        self.searchIndex = BigramIndex(self.textContent)
+        self.searchWorker = SearchIndexWorker(self.searchIndex, parent=self)
+        self.searchWorker.completed.connect(self.onSearchIndexCompleted)
+        self.searchWorker.skipped.connect(self.onSearchIndexSkipped)
+        self.searchWorker.start(SearchIndexWorker.Priority.LowPriority)
+
+    def onSearchIndexCompleted(self):
+        self.content.set_derived('search', self.searchIndex)
+        if self.searchMenu is not None:
+            self.searchMenu.updateStatus()
+
+    def onSearchIndexSkipped(self):
+        if self.searchMenu is not None:
+            self.searchMenu.updateStatus()
+
+    def stopSearchIndex(self):
+        if self.searchWorker is not None:
+            self.searchWorker.completed.disconnect(self.onSearchIndexCompleted)
+            self.searchWorker.skipped.disconnect(self.onSearchIndexSkipped)
+            self.searchWorker.cancel()
+            self.searchWorker.deleteLater()
+            self.searchWorker = None
+
+    def displayLibrarySearch(self):
+        """显示书库搜索窗口"""
+        if self.librarySearchMenu is None:
+            self.librarySearchMenu = LibrarySearchMenu()
+        self.librarySearchMenu.show()
+        self.librarySearchMenu.activateWindow()
+
+    def updateLibraryIndex(self):
+        """书库索引中没有这本书或内容已变化时，在后台更新"""
+        if self.libraryWorker is not None or libraryIndex.is_current(self.filePath, self.fingerprint):
+            return
+        self.libraryWorker = LibraryIndexWorker(self.filePath, self.fingerprint, self.textContent, self.encoding,
+                                                parent=self)
+        self.libraryWorker.start(LibraryIndexWorker.Priority.LowestPriority)
+
+    def stopLibraryIndex(self):
+        if self.libraryWorker is not None:
+            self.libraryWorker.cancel()
+            self.libraryWorker.deleteLater()
+            self.libraryWorker = None
+
     def displayHistory(self):
         """显示历史记录窗口"""
         self.historyMenu = HistoryMenu(self)
@@ -323,23 +530,31 @@ class ReadWindow(QWidget):
         # 如果正在调整大小
         if self.resizing and event.buttons() & Qt.MouseButton.LeftButton:
             x, y = event.pos().x(), event.pos().y()
-            geometry = self.geometry()
+            if self.pendingGeometry is not None:
+                # 鼠标位置相对于已显示的窗口，换算到尚未应用的几何
+                x += self.geometry().x() - self.pendingGeometry.x()
+                y += self.geometry().y() - self.pendingGeometry.y()
+
+            # 以尚未应用的几何为基准，保证合并的多次移动不丢失位移
+            geometry = self.geometry() if self.pendingGeometry is None else self.pendingGeometry
 
             if self.resizeDirection == "left":
                 width = geometry.width() - x
-                self.setGeometry(geometry.x() + x, geometry.y(), width, geometry.height())
+                geometry.setRect(geometry.x() + x, geometry.y(), width, geometry.height())
             elif self.resizeDirection == "right":
                 width = x
-                self.setGeometry(geometry.x(), geometry.y(), width, geometry.height())
+                geometry.setRect(geometry.x(), geometry.y(), width, geometry.height())
             elif self.resizeDirection == "top":
                 height = geometry.height() - y
-                self.setGeometry(geometry.x(), geometry.y() + y, geometry.width(), height)
+                geometry.setRect(geometry.x(), geometry.y() + y, geometry.width(), height)
             elif self.resizeDirection == "bottom":
                 height = y
-                self.setGeometry(geometry.x(), geometry.y(), geometry.width(), height)
+                geometry.setRect(geometry.x(), geometry.y(), geometry.width(), height)
 
-            # 更新文本布局以适应新的窗口大小
-            self.updateTextLayout()
+            # 每帧最多应用一次几何变化，重新排版推迟到松开鼠标
+            self.pendingGeometry = geometry
+            if not self.geometryTimer.isActive():
+                self.geometryTimer.start()
         # 如果是拖动窗口
         elif event.buttons() & Qt.MouseButton.LeftButton:
             delta = event.pos() - self.mousePosition
@@ -349,7 +564,10 @@ class ReadWindow(QWidget):
             self.updateCursorShape(event.pos())
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
-        self.resizing = False
+        if self.resizing:
+            self.resizing = False
+            self.applyPendingGeometry()
+            self.settleLayout()
         self.mousePosition = QPoint()
         # 重置鼠标指针
         self.setCursor(Qt.CursorShape.ArrowCursor)
@@ -369,14 +587,23 @@ class ReadWindow(QWidget):
             self.setCursor(Qt.CursorShape.ArrowCursor)
 
     def rollPageActive(self, page):
-        text, _ = self.rollPage(page)
+        offset = self.pageIndex.offset(page)
+        if offset is not None:
+            self.showAnchor(offset)
+
+    def showAnchor(self, anchor, step=0):
+        """显示从 anchor 开始的一页，step 为翻页方向，跳转时为 0"""
+        if perf.enabled():
+            self.flipStarted = time.perf_counter()
+        text, _ = self.layoutAt(anchor)
         if text:
+            # 窗口保持显示，只重绘内容变化的行
+            damage = self.pageRenderer.damage(self.text, text, self.size())
             self.text = text
-            self.needFullRepaint = True
-
-            # 强制完全重绘
-            self.hide()
-            self.show()
+            self.prefetcher.flipped(step)
+            self.update(damage)
+        else:
+            self.flipStarted = None
 
     def enterEvent(self, event: QMouseEvent) -> None:
         self.qPen = QPen(settingData.qColor)
@@ -387,48 +614,55 @@ class ReadWindow(QWidget):
         self.update()
 
     def closeEvent(self, event):
-        settingData.writeData()
+        if self.fullTextView is not None:
+            self.fullTextView.close()
+        self.stopPagination()
+        self.stopSearchIndex()
+        self.stopLibraryIndex()
+        settingData.changed.disconnect(self.onSettingChanged)
+        # 阅读位置已保存在历史记录中，设置在退出前写入
+        settingData.scheduleWrite()
+        historyStore.flush()
         event.accept()
 
     def getChapter(self):
-        chapter = {}
-        page = 0
-        mark = 0
-        temp, mark = self.subText(mark)
-        pattern = re.compile(r'(第)([\u4e00-\u9fa5a-zA-Z0-9]{1,7})[章|节].{0,20}(\n|$)')
-
-        while len(temp) > 1:
-            lines = temp.splitlines()
-            for i in range(len(lines)):
-                line = lines[i].strip()
-                if re.match(pattern, line):
-                    chapter[line] = page
-            page += 1
-            temp, mark = self.subText(mark)
-        return chapter
-
-    def jumpToChapter(self, item, chapter):
-        text = ''
-        page = chapter[item.text()]
-        settingData.currentPage = page
-        settingData.lastPage = page
-        mark = 0
-        for i in range(0, page + 1):
-            settingData.pages[i % settingData.pageSize] = mark
-            text, mark = self.subText(mark)
-        settingData.pages[(page + 1) % settingData.pageSize] = mark
-        self.text = text
+        """获取打开书籍时扫描出的章节列表"""
+        return self.chapters
+
+    def jumpToChapter(self, row):
+        """跳转到第 row 个章节所在的页"""
+        self.jumpToOffset(self.chapters[row].offset)
+
+    def jumpToOffset(self, offset):
+        """跳转到包含字符位置 offset 的页"""
+        if self.pageIndex.covers(offset):
+            self.rollPageActive(self.pageIndex.page_of(offset))
+            return
+        # 索引尚未覆盖该位置时不在界面线程中分页，只在附近局部排版，后台继续补全索引，
+        # 之后向前翻页时会重新与索引对齐
+        self.showAnchor(self.textLayout.page_start(self.textContent, offset))
+
+    def applyPendingGeometry(self):
+        """应用拖动过程中合并的几何变化"""
+        self.geometryTimer.stop()
+        if self.pendingGeometry is not None:
+            geometry, self.pendingGeometry = self.pendingGeometry, None
+            self.setGeometry(geometry)
+
+    def settleLayout(self):
+        """尺寸确定后重新排版"""
+        self.updateTextLayout()
         self.update()
 
     def resizeEvent(self, event):
         """当窗口大小改变时调用此方法"""
         super().resizeEvent(event)
+        if self.resizing:
+            # 拖动过程中只裁剪显示上一帧，松开鼠标后再重新排版一次
+            self.update()
+            return
         # 重新计算文本布局
-        self.updateTextLayout()
-        # 标记需要完全重绘
-        self.needFullRepaint = True
-        # 更新显示
-        self.update()
+        self.settleLayout()
 
     def updateTextLayout(self):
         """更新文本布局以适应当前窗口大小"""
@@ -441,56 +675,43 @@ class ReadWindow(QWidget):
         charWidth = fontMetrics.horizontalAdvance('中')  # 使用中文字符宽度作为参考
         lineHeight = fontMetrics.height() + settingData.lineSpacing
 
-        # 计算新的行大小和行数
+        # 计算新的行大小和行数，最后一行下面没有行间距
         newLineSize = max(1, int(width / charWidth))
-        newTextLine = max(1, int(height / lineHeight))
+        newTextLine = max(1, int((height + settingData.lineSpacing) / lineHeight))
 
         # 如果行大小或行数发生变化，更新设置并重新加载文本
         if newLineSize != settingData.lineSize or newTextLine != settingData.textLine:
             settingData.lineSize = newLineSize
             settingData.textLine = newTextLine
-
-            # 重新加载当前页面的文本
-            self.text, _ = self.rollPage(settingData.currentPage)
+            settingData.scheduleWrite()
+            self.reflow()
+
+    def reflow(self):
+        """从当前阅读位置重新排版，屏幕顶部保持同一句话，全书索引在后台重建"""
+        self.resetPageIndex()
+        self.text, _ = self.layoutAt(self.anchor)
+        self.prefetcher.flipped()
+
+    def onSettingChanged(self, change):
+        """按设置变化的类型做最少的更新"""
+        if change == SettingChange.COLOR:
+            # 只重新着色，字形遮罩仍然可用
+            self.qPen = QPen(settingData.qColor if self.underMouse() else settingData.outColor)
+            self.update()
+        elif change == SettingChange.SHORTCUT:
+            self.next.setKey(QKeySequence(settingData.nextShortCut))
+            self.last.setKey(QKeySequence(settingData.lastShortCut))
+        else:
+            if change == SettingChange.LAYOUT or self.createTextLayout().key != self.textLayout.key:
+                # 每行字数、行数变化，或者按字体折行时换了字体，需要重新排版
+                self.reflow()
+            # 窗口大小跟随设置，页面内容相同时 resizeEvent 不会再次排版，绘制时按新样式重新生成图像
+            self.resize(*self.textSize())
+            self.update()
 
     def addToHistory(self, filePath):
         """添加文件到历史记录"""
-        # 历史记录文件路径
-        history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
-
-        # 读取现有历史记录
-        history = []
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                # 如果文件损坏，创建新的历史记录
-                history = []
-
-        # 检查文件是否已在历史记录中
-        for item in history:
-            if item['path'] == filePath:
-                # 如果已存在，更新访问时间并移到列表前面
-                history.remove(item)
-                break
-
-        # 添加新记录到列表前面
-        history.insert(0, {
-            'path': filePath,
-            'name': os.path.basename(filePath),
-            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
-
-        # 限制历史记录数量为20条
-        history = history[:20]
-
-        # 保存历史记录
-        try:
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存历史记录失败: {e}")
+        historyStore.add(filePath)
 
     def openHistoryFile(self, filePath):
         """打开历史记录中的文件"""
@@ -499,7 +720,6 @@ class ReadWindow(QWidget):
             self.close()
 
             # 创建新窗口打开选定的文件
-            from main import createReadWindow  # 导入创建窗口的函数
             createReadWindow(filePath)
         else:
             # 文件不存在，显示错误消息
@@ -511,42 +731,146 @@ class ReadWindow(QWidget):
 
     def removeFromHistory(self, filePath):
         """从历史记录中移除文件"""
-        history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
-
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-
-                # 移除指定文件
-                history = [item for item in history if item['path'] != filePath]
-
-                # 保存更新后的历史记录
-                with open(history_file, 'w', encoding='utf-8') as f:
-                    json.dump(history, f, ensure_ascii=False, indent=2)
-            except Exception as e:
-                print(f"更新历史记录失败: {e}")
+        historyStore.remove(filePath)
 
 
 class ScrollableMenu(QWidget):
     def __init__(self, readWindow):
         super().__init__()
-        chapter = readWindow.getChapter()
+        chapters = readWindow.getChapter()
         self.setWindowTitle('选择章节')
         layout = QVBoxLayout(self)
 
         listWidget = QListWidget()
-        for key in chapter.keys():
-            listWidget.addItem(QListWidgetItem(key))
-        listWidget.itemDoubleClicked.connect(lambda item: readWindow.jumpToChapter(item, chapter))
+        listWidget.addItems([chapter.title for chapter in chapters])
+        listWidget.itemDoubleClicked.connect(lambda item: readWindow.jumpToChapter(listWidget.row(item)))
 
         layout.addWidget(listWidget)
 
 
+class SearchMenu(QWidget):
+    # 列表中最多显示的结果数
+    MAX_LISTED = 1000
+
+    def __init__(self, readWindow):
+        super().__init__()
+        self.readWindow = readWindow
+        self.setWindowTitle('搜索')
+        layout = QVBoxLayout(self)
+
+        inputLayout = QHBoxLayout()
+        self.queryEdit = QLineEdit()
+        self.queryEdit.setPlaceholderText("输入要查找的文字")
+        self.queryEdit.returnPressed.connect(self.runSearch)
+        inputLayout.addWidget(self.queryEdit)
+        self.searchButton = QPushButton("搜索")
+        self.searchButton.clicked.connect(self.runSearch)
+        inputLayout.addWidget(self.searchButton)
+        layout.addLayout(inputLayout)
+
+        self.statusLabel = QLabel()
+        layout.addWidget(self.statusLabel)
+
+        self.listWidget = QListWidget()
+        self.listWidget.itemDoubleClicked.connect(self.openResult)
+        layout.addWidget(self.listWidget)
+
+        self.resize(500, 400)
+        self.updateStatus()
+
+    def updateStatus(self):
+        if self.readWindow.searchIndex.skipped:
+            if not self.listWidget.count():
+                self.statusLabel.setText(f"全书超过 {MAX_INDEX_LENGTH // (1024 * 1024)}M 字，不建立索引，逐字查找")
+        elif not self.readWindow.searchIndex.complete:
+            self.statusLabel.setText("正在建立索引，建好之前逐字查找")
+        elif not self.listWidget.count():
+            self.statusLabel.setText("索引已建立")
+
+    @perf.timed('search')
+    def runSearch(self):
+        """查找并列出所有结果，每项显示命中位置前后的文字"""
+        query = self.queryEdit.text()
+        self.listWidget.clear()
+        if not query:
+            return
+        text = self.readWindow.textContent
+        hits = self.readWindow.searchIndex.search(query)
+        for offset in hits[:self.MAX_LISTED]:
+            item = QListWidgetItem(snippet(text, offset, len(query)))
+            item.setData(Qt.ItemDataRole.UserRole, offset)
+            self.listWidget.addItem(item)
+        status = f"共 {len(hits)} 处"
+        if len(hits) > self.MAX_LISTED:
+            status += f"，显示前 {self.MAX_LISTED} 处"
+        self.statusLabel.setText(status)
+
+    def openResult(self, item):
+        """跳转到结果所在的页"""
+        self.readWindow.jumpToOffset(item.data(Qt.ItemDataRole.UserRole))
+
+
+class LibrarySearchMenu(QWidget):
+    def __init__(self):
+        """在所有打开过或预索引过的书中搜索，双击结果打开书并跳转到命中位置"""
+        super().__init__()
+        self.setWindowTitle('搜索书库')
+        layout = QVBoxLayout(self)
+
+        inputLayout = QHBoxLayout()
+        self.queryEdit = QLineEdit()
+        self.queryEdit.setPlaceholderText("输入要查找的文字或人名，至少两个字")
+        self.queryEdit.returnPressed.connect(self.runSearch)
+        inputLayout.addWidget(self.queryEdit)
+        self.searchButton = QPushButton("搜索")
+        self.searchButton.clicked.connect(self.runSearch)
+        inputLayout.addWidget(self.searchButton)
+        layout.addLayout(inputLayout)
+
+        self.statusLabel = QLabel()
+        layout.addWidget(self.statusLabel)
+
+        self.listWidget = QListWidget()
+        self.listWidget.itemDoubleClicked.connect(self.openResult)
+        layout.addWidget(self.listWidget)
+
+        self.resize(600, 400)
+
+    def runSearch(self):
+        query = self.queryEdit.text()
+        self.listWidget.clear()
+        if len(query) < 2:
+            self.statusLabel.setText("请输入至少两个字")
+            return
+        hits = libraryIndex.search(query)
+        for hit in hits:
+            item = QListWidgetItem(f"{hit.name}: {hit.snippet}")
+            item.setData(Qt.ItemDataRole.UserRole, (hit.path, hit.offset))
+            self.listWidget.addItem(item)
+        books = len({hit.path for hit in hits})
+        self.statusLabel.setText(f"在 {books} 本书中找到 {len(hits)} 处")
+
+    def openResult(self, item):
+        """打开结果所在的书并跳转到命中位置所在的页"""
+        filePath, offset = item.data(Qt.ItemDataRole.UserRole)
+        if not os.path.exists(filePath):
+            from PySide6.QtWidgets import QMessageBox
+            QMessageBox.warning(self, "文件不存在", f"文件 {filePath} 不存在或已被移动。")
+            return
+        createReadWindow(filePath).jumpToOffset(offset)
+
+
 class HistoryMenu(QWidget):
+    # 后台线程检查完一个文件是否存在，在界面线程中更新对应的项
+    existsChecked = Signal(str, bool)
+
     def __init__(self, readWindow):
         super().__init__()
         self.readWindow = readWindow
+        # 路径 -> 列表项，以及尚未完成的存在检查
+        self.rows = {}
+        self.checks = []
+        self.existsChecked.connect(self.onExistsChecked)
         self.setWindowTitle('历史记录')
 
         # 创建主布局
@@ -587,43 +911,39 @@ class HistoryMenu(QWidget):
         self.listWidget.itemDoubleClicked.connect(self.openHistoryItem)
 
     def loadHistory(self):
-        """加载历史记录"""
-        history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
-
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-
-                # 清空列表
-                self.listWidget.clear()
-
-                # 添加历史记录项
-                for item in history:
-                    file_path = item['path']
-                    file_name = item['name']
-                    access_time = item['time']
-
-                    # 检查文件是否存在
-                    file_exists = os.path.exists(file_path)
-
-                    # 创建列表项
-                    display_text = f"{file_name} - {access_time}"
-                    if not file_exists:
-                        display_text += " (文件不存在)"
-
-                    list_item = QListWidgetItem(display_text)
-                    list_item.setData(Qt.ItemDataRole.UserRole, file_path)
-
-                    # 如果文件不存在，使用灰色显示
-                    if not file_exists:
-                        list_item.setForeground(QColor(150, 150, 150))
-
-                    self.listWidget.addItem(list_item)
-            except Exception as e:
-                self.listWidget.addItem(f"加载历史记录失败: {e}")
-        else:
+        """加载历史记录，文件是否存在在后台检查，检查完一项更新一项"""
+        self.cancelChecks()
+        self.listWidget.clear()
+        self.rows = {}
+        items = historyStore.items()
+        if not items:
             self.listWidget.addItem("没有历史记录")
+            return
+
+        # 添加历史记录项
+        for item in items:
+            list_item = QListWidgetItem(f"{item['name']} - {item['time']}")
+            list_item.setData(Qt.ItemDataRole.UserRole, item['path'])
+            self.listWidget.addItem(list_item)
+            self.rows[item['path']] = list_item
+        self.checks = historyStore.check_exists(list(self.rows), self.existsChecked.emit)
+
+    def onExistsChecked(self, filePath, exists):
+        list_item = self.rows.get(filePath)
+        if list_item is None or exists:
+            return
+        # 如果文件不存在，使用灰色显示
+        list_item.setText(list_item.text() + " (文件不存在)")
+        list_item.setForeground(QColor(150, 150, 150))
+
+    def cancelChecks(self):
+        for future in self.checks:
+            future.cancel()
+        self.checks = []
+
+    def closeEvent(self, event):
+        self.cancelChecks()
+        super().closeEvent(event)
 
     def openHistoryItem(self, item):
         """打开选中的历史记录项"""
@@ -633,15 +953,6 @@ class HistoryMenu(QWidget):
 
     def clearHistory(self):
         """清除所有历史记录"""
-        history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
-
-        try:
-            # 创建空的历史记录
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump([], f)
-
-            # 刷新显示
-            self.loadHistory()
-        except Exception as e:
-            from PySide6.QtWidgets import QMessageBox
-            QMessageBox.warning(self, "错误", f"清除历史记录失败: {e}")
+        historyStore.clear()
+        # 刷新显示
+        self.loadHistory()
@@ -1,23 +1,54 @@
 import configparser
+import io
+import os
+from enum import Enum
 
+import perf
+
+from PySide6.QtCore import QCoreApplication, QObject, QTimer, Signal
 from PySide6.QtGui import QFont, QColor
 
 config = configparser.ConfigParser()
+SETTINGS_FILE = 'settings.ini'
+
+
+class SettingChange(Enum):
+    """设置变化的类型，各窗口按类型只做必要的更新"""
+    # 文字颜色，只需要重新着色
+    COLOR = 'color'
+    # 行间距，只需要重新绘制
+    SPACING = 'spacing'
+    # 字体，按字体折行时需要重新排版
+    FONT = 'font'
+    # 每行字数、行数，需要从当前位置重新排版
+    LAYOUT = 'layout'
+    # 翻页快捷键
+    SHORTCUT = 'shortcut'
 
 
 #  单例模式
-class SettingData:
+class SettingData(QObject):
+    # 设置变化后发出，参数为 SettingChange
+    changed = Signal(object)
+
     def __init__(self):
+        super().__init__()
         self.filePath = ""
+        # 是否已读取过 settings.ini，整个进程只需要读取一次
+        self.loaded = False
         self.textLine = 2
         self.lineSize = 20
         self.lineSpacing = 3
-        self.pageSize = 20
-        self.pages = [0] * self.pageSize
-        self.lastPage = 0
-        self.currentPage = 0
+        # 折行方式：chars 按固定字数折行，glyph 按字符实际宽度折行并遵守避头尾规则
+        self.wrapMode = 'chars'
+        # 当前页起始位置的字符偏移，与排版无关
+        self.anchor = 0
         self.nextShortCut = 'C'
         self.lastShortCut = 'Z'
+        # 向后、向前预先准备的页数，以及预取图像的内存预算（MB）
+        self.prefetchNext = 3
+        self.prefetchPrev = 1
+        self.prefetchBudget = 32
         self.font = 'Arial'
         self.size = 12
         self.qFont = QFont(self.font, self.size)
@@ -31,9 +62,16 @@ class SettingData:
         self.outBlue = 0
         self.outAlpha = 0
         self.outColor = QColor(self.outRed, self.outGreen, self.outBlue, self.outAlpha)
+        # 上次写入的内容，没有变化时不再写入
+        self.written = None
+        # 合并短时间内的多次修改，延迟写入 settings.ini
+        self.writeTimer = None
+        self.quitHooked = False
 
     def readData(self):
-        config.read('settings.ini', encoding='utf-8')
+        with perf.span('settings_read'):
+            config.read(SETTINGS_FILE, encoding='utf-8')
+        self.loaded = True
         try:
             # 尝试读取 'filepath'（小写，与settings.ini匹配）
             self.filePath = config.get('file', 'filepath')
@@ -49,15 +87,13 @@ class SettingData:
         self.textLine = int(config.get('settings', 'textline'))
         self.lineSize = int(config.get('settings', 'linesize'))
         self.lineSpacing = int(config.get('settings', 'linespacing'))
-        self.pageSize = int(config.get('settings', 'pagesize'))
-        pages = config.get('settings', 'pages').split(',')
-        self.pages = [0] * self.pageSize
-        for i in range(0, len(pages)):
-            self.pages[i] = int(pages[i])
-        self.lastPage = int(config.get('settings', 'lastpage'))
-        self.currentPage = int(config.get('settings', 'currentpage'))
+        self.wrapMode = config.get('settings', 'wrapmode', fallback=self.wrapMode)
+        self.anchor = config.getint('settings', 'anchor', fallback=0)
         self.nextShortCut = config.get('settings', 'nextshortcut')
         self.lastShortCut = config.get('settings', 'lastshortcut')
+        self.prefetchNext = config.getint('settings', 'prefetchnext', fallback=self.prefetchNext)
+        self.prefetchPrev = config.getint('settings', 'prefetchprev', fallback=self.prefetchPrev)
+        self.prefetchBudget = config.getint('settings', 'prefetchbudget', fallback=self.prefetchBudget)
         self.font = config.get('fontSettings', 'font')
         self.size = int(config.get('fontSettings', 'size'))
         self.qFont = QFont(self.font, self.size)
@@ -72,19 +108,58 @@ class SettingData:
         self.outAlpha = int(config.get('fontSettings', 'outalpha'))
         self.outColor = QColor(self.outRed, self.outGreen, self.outBlue, self.outAlpha)
 
+    def change(self, kind: SettingChange, **values):
+        """修改设置并通知各窗口，稍后写入文件
+
+        Args:
+            kind: 变化的类型
+            values: 要修改的属性及新值
+        """
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.changed.emit(kind)
+        self.scheduleWrite()
+
+    def scheduleWrite(self, delay=500):
+        """delay 毫秒内没有新的修改时写入文件，程序退出前写入尚未写入的修改"""
+        if self.writeTimer is None:
+            self.writeTimer = QTimer(self)
+            self.writeTimer.setSingleShot(True)
+            self.writeTimer.timeout.connect(self.writeData)
+        app = QCoreApplication.instance()
+        if app is None:
+            self.writeData()
+            return
+        if not self.quitHooked:
+            app.aboutToQuit.connect(self.flush)
+            self.quitHooked = True
+        self.writeTimer.start(delay)
+
+    def flush(self):
+        """立即写入尚未写入的修改"""
+        if self.writeTimer is not None and self.writeTimer.isActive():
+            self.writeData()
+
     def writeData(self):
+        if self.writeTimer is not None:
+            self.writeTimer.stop()
+        for section in ('file', 'settings', 'fontSettings'):
+            if not config.has_section(section):
+                config.add_section(section)
         config.set('file', 'filepath', self.filePath)
         config.set('settings', 'textline', str(self.textLine))
         config.set('settings', 'linesize', str(self.lineSize))
         config.set('settings', 'linespacing', str(self.lineSpacing))
-        config.set('settings', 'pagesize', str(self.pageSize))
-        stringList = [str(i) for i in self.pages]
-        newString = ','.join(stringList)
-        config.set('settings', 'pages', newString)
-        config.set('settings', 'lastpage', str(self.lastPage))
-        config.set('settings', 'currentpage', str(self.currentPage))
+        config.set('settings', 'wrapmode', self.wrapMode)
+        # 页偏移改由全书分页索引维护，阅读位置改为字符偏移，移除旧版的配置项
+        for option in ('pagesize', 'pages', 'lastpage', 'currentpage'):
+            config.remove_option('settings', option)
+        config.set('settings', 'anchor', str(self.anchor))
         config.set('settings', 'nextshortcut', self.nextShortCut)
         config.set('settings', 'lastshortcut', self.lastShortCut)
+        config.set('settings', 'prefetchnext', str(self.prefetchNext))
+        config.set('settings', 'prefetchprev', str(self.prefetchPrev))
+        config.set('settings', 'prefetchbudget', str(self.prefetchBudget))
         config.set('fontSettings', 'font', self.qFont.family())
         config.set('fontSettings', 'size', str(self.qFont.pointSize()))
         config.set('fontSettings', 'red', str(self.qColor.red()))
@@ -96,8 +171,22 @@ class SettingData:
         config.set('fontSettings', 'outblue', str(self.outColor.blue()))
         config.set('fontSettings', 'outalpha', str(self.outColor.alpha()))
 
-        with open('settings.ini', 'w', encoding='utf-8') as configfile:
-            config.write(configfile)
+        buffer = io.StringIO()
+        config.write(buffer)
+        data = buffer.getvalue()
+        if data == self.written:
+            return
+        # 先写入临时文件再替换，写入中途退出不会损坏原有设置
+        with perf.span('settings_write'):
+            temp = SETTINGS_FILE + '.tmp'
+            try:
+                with open(temp, 'w', encoding='utf-8') as configfile:
+                    configfile.write(data)
+                os.replace(temp, SETTINGS_FILE)
+            except OSError as e:
+                print(f"保存设置失败: {e}")
+                return
+        self.written = data
 
 
 settingData = SettingData()
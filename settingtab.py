@@ -1,6 +1,6 @@
 from PySide6.QtWidgets import QWidget, QPushButton, QFontDialog, QGridLayout, QColorDialog, QLabel, QSpinBox, \
-    QKeySequenceEdit, QVBoxLayout, QHBoxLayout, QLineEdit
-from settingdata import settingData
+    QKeySequenceEdit, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox
+from settingdata import SettingChange, settingData
 from PySide6.QtCore import Qt
 
 
@@ -40,6 +40,13 @@ class SettingsTab(QWidget):
         self.lineSpacingSet.setMinimum(0)
         self.lineSpacingSet.setMinimumWidth(60)
 
+        # 折行方式，按字宽折行时标点不会出现在行首
+        self.wrapModeSet = QComboBox()
+        self.wrapModeSet.addItem('按字数', 'chars')
+        self.wrapModeSet.addItem('按字宽', 'glyph')
+        self.wrapModeSet.setCurrentIndex(max(0, self.wrapModeSet.findData(settingData.wrapMode)))
+        self.wrapModeSet.currentIndexChanged.connect(self.changeWrapMode)
+
         self.textLineSet.valueChanged.connect(self.changeTextLine)
         self.lineSizeSet.valueChanged.connect(self.changeLineSize)
         self.lineSpacingSet.valueChanged.connect(self.changeLineSpacing)
@@ -54,6 +61,7 @@ class SettingsTab(QWidget):
         self.textLine = setTextAndComp('文本行数', self.textLineSet)
         self.lineSize = setTextAndComp('行文字数', self.lineSizeSet)
         self.textSpacing = setTextAndComp('行间距   ', self.lineSpacingSet)
+        self.wrapMode = setTextAndComp('折行方式', self.wrapModeSet)
         self.textLayout.addLayout(self.textLine)
         self.textLayout.addLayout(self.lineSize)
         # self.textLayout.addLayout(self.textSpacing)
@@ -73,34 +81,38 @@ class SettingsTab(QWidget):
         # self.mainLayout.addLayout(self.textLine)
         # self.mainLayout.addLayout(self.lineSize)
         self.mainLayout.addLayout(self.textSpacing)
+        self.mainLayout.addLayout(self.wrapMode)
         self.mainLayout.addLayout(self.shortCutLayout)
 
     def changeFont(self):
         ok, font = QFontDialog().getFont(settingData.qFont, self)  # 显示字体选择对话框
         if ok:
-            settingData.qFont = font
+            settingData.change(SettingChange.FONT, qFont=font)
 
     def changeColor(self):
         color = QColorDialog.getColor(settingData.qColor, self, options=QColorDialog.ColorDialogOption.ShowAlphaChannel)
         if color.isValid():
-            settingData.qColor = color
+            settingData.change(SettingChange.COLOR, qColor=color)
 
     def changeOutColor(self):
         color = QColorDialog.getColor(settingData.outColor, self, options=QColorDialog.ColorDialogOption.ShowAlphaChannel)
         if color.isValid():
-            settingData.outColor = color
+            settingData.change(SettingChange.COLOR, outColor=color)
 
     def changeTextLine(self, value):
-        settingData.textLine = value
+        settingData.change(SettingChange.LAYOUT, textLine=value)
 
     def changeLineSize(self, value):
-        settingData.lineSize = value
+        settingData.change(SettingChange.LAYOUT, lineSize=value)
+
+    def changeWrapMode(self, index):
+        settingData.change(SettingChange.LAYOUT, wrapMode=self.wrapModeSet.itemData(index))
 
     def changeLineSpacing(self, value):
-        settingData.lineSpacing = value
+        settingData.change(SettingChange.SPACING, lineSpacing=value)
 
     def changeNext(self, text):
-        settingData.nextShortCut = text
+        settingData.change(SettingChange.SHORTCUT, nextShortCut=text)
 
     def changeLast(self, text):
-        settingData.lastShortCut = text
+        settingData.change(SettingChange.SHORTCUT, lastShortCut=text)
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from chapters import scan_chapters
+from document import MappedDocument
+from pageindex import PageIndex
+from textlayout import TextLayout
+
+
+class SmallBlocks(MappedDocument):
+    # 用很小的块覆盖跨块的情况
+    BLOCK_SIZE = 64
+
+
+def open_doc(tmp_path, text, encoding='utf-8', newline='\n'):
+    path = tmp_path / 'book.txt'
+    path.write_bytes(text.replace('\n', newline).encode(encoding))
+    return SmallBlocks(str(path), encoding, max_blocks=4)
+
+
+def build(text, layout):
+    index = PageIndex(lambda mark: layout.next_mark(text, mark), len(text))
+    index.build()
+    return list(index.offsets)
+
+
+@pytest.mark.parametrize('encoding, newline', [('utf-8', '\n'), ('gbk', '\r\n'), ('utf-8', '\r')])
+def test_matches_str(tmp_path, encoding, newline):
+    rng = random.Random(0)
+    text = ''.join(rng.choice('字字字文ab\n') for _ in range(3000))
+    doc = open_doc(tmp_path, text, encoding, newline)
+    try:
+        assert len(doc) == len(text)
+        assert doc[:] == text
+        for _ in range(300):
+            start = rng.randint(-20, len(text) + 20)
+            end = rng.choice([None, rng.randint(-20, len(text) + 20)])
+            sub = rng.choice(['', '\n', '字', 'a\n', '文字ab', '\n\n'])
+            assert doc[start:end] == text[start:end]
+            assert doc.find(sub, start, end) == text.find(sub, start, end)
+            assert doc.rfind(sub, start, end) == text.rfind(sub, start, end)
+        assert ''.join(window for _, window in doc.windows()) == text
+        assert scan_chapters(doc) == scan_chapters(text)
+    finally:
+        doc.close()
+
+
+@pytest.mark.parametrize('layout', [TextLayout(7, 5), TextLayout(33, 20)])
+def test_page_offsets(tmp_path, layout):
+    text = "第一章 开始\n\n" + "\n".join("段落" * n for n in range(1, 80)) + "\n" + "长" * 2000
+    doc = open_doc(tmp_path, text)
+    try:
+        assert build(doc, layout) == build(text, layout)
+    finally:
+        doc.close()
+
+
+def test_single_line_stays_local(tmp_path):
+    """没有换行的文件排版一页只解码附近的块，不会解码到文件末尾"""
+    doc = open_doc(tmp_path, "字" * 20000)
+    try:
+        decoded = []
+        block = MappedDocument.block
+        doc.block = lambda index: decoded.append(index) or block(doc, index)
+        layout = TextLayout(10, 2)
+        mark = layout.next_mark(doc, 0)
+        assert mark == 20
+        assert max(decoded) <= 1
+        assert layout.previous_mark(doc, 10000) < 10000
+        assert max(decoded) < doc.block_of(10000) + 2
+    finally:
+        doc.close()
@@ -0,0 +1,31 @@
+import sqlite3
+
+from history import HistoryStore
+
+
+def test_failed_flush_keeps_changes(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / 'history.db'), str(tmp_path / 'history.json'), delay=60)
+    store.add('/books/a.txt')
+    store.set_position('fp', 5, 'chars:10x5')
+    connect = store.connect
+
+    def fail():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(store, 'connect', fail)
+    store.flush()
+    assert list(store.pending) == ['/books/a.txt']
+    assert store.timer is not None
+
+    # 失败后产生的新位置不能被旧的变化覆盖
+    store.set_position('fp', 9, 'chars:10x5')
+    store.add('/books/b.txt')
+    monkeypatch.setattr(store, 'connect', connect)
+    store.flush()
+    conn = sqlite3.connect(str(tmp_path / 'history.db'))
+    try:
+        assert conn.execute('SELECT path FROM history ORDER BY rowid').fetchall() == [('/books/a.txt',),
+                                                                                     ('/books/b.txt',)]
+        assert conn.execute('SELECT anchor FROM positions').fetchall() == [(9,)]
+    finally:
+        conn.close()
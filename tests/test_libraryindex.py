@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from libraryindex import LibraryIndex
+
+
+def test_concurrent_schema_setup(tmp_path):
+    """多个连接同时第一次打开书库索引时只建立一次表"""
+    db_path = str(tmp_path / 'library' / 'library.db')
+
+    def connect(_):
+        conn = LibraryIndex(db_path).connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(connect, range(32))) == [0] * 32
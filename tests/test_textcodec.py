@@ -0,0 +1,44 @@
+import codecs
+
+import pytest
+
+from textcodec import SAMPLE_SIZE, decode_file, detect_encoding
+
+# 不含 ASCII 字节的中文，采样位置没有换行符
+CHINESE = '这是一个没有换行也没有标点的长段落用于检测中间与末尾的采样' * 10000
+
+
+def write(tmp_path, data):
+    path = tmp_path / 'book.txt'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('shift', [0, 1, 2])
+def test_utf8_without_ascii(tmp_path, shift):
+    data = ('字' * shift + CHINESE).encode('utf-8')
+    assert len(data) > SAMPLE_SIZE * 3
+    path = write(tmp_path, data)
+    encodings = detect_encoding(path)
+    assert encodings[0] == 'utf-8'
+    assert decode_file(path, encodings)[0] == '字' * shift + CHINESE
+
+
+@pytest.mark.parametrize('shift', [0, 1])
+def test_gbk_without_ascii(tmp_path, shift):
+    path = write(tmp_path, ('字' * shift + CHINESE).encode('gbk'))
+    assert detect_encoding(path)[0] in ('gbk', 'gb18030')
+
+
+@pytest.mark.parametrize('codec, bom', [
+    ('utf-32-le', codecs.BOM_UTF32_LE),
+    ('utf-32-be', codecs.BOM_UTF32_BE),
+    ('utf-16-le', codecs.BOM_UTF16_LE),
+    ('utf-16-be', codecs.BOM_UTF16_BE),
+    ('utf-8', codecs.BOM_UTF8),
+])
+def test_bom(tmp_path, codec, bom):
+    text = '第一章\r\n正文\r\n'
+    path = write(tmp_path, bom + text.encode(codec))
+    encodings = detect_encoding(path)
+    assert decode_file(path, encodings)[0] == '第一章\n正文\n'
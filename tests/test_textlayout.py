@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from textlayout import TextLayout
+
+
+def sub_text(text, mark, line_size, text_line):
+    """原 ReadWindow.subText 的逐字符排版，作为对照"""
+    count = 0
+    line = 0
+    string = ""
+    for i in range(mark, len(text)):
+        char = text[i]
+        if char == '\n':
+            try:
+                if text[i + 1] != '\n':
+                    string += char
+                    count = 0
+                    line += 1
+            except IndexError:
+                string += char
+                break
+        else:
+            string += char
+            count += 1
+            if count >= line_size:
+                string += '\n'
+                count = 0
+                line += 1
+        mark += 1
+        if line >= text_line:
+            break
+    return string, mark
+
+
+def paginate(text, line_size, text_line):
+    layout = TextLayout(line_size, text_line)
+    mark = 0
+    while mark < len(text):
+        expected = sub_text(text, mark, line_size, text_line)
+        assert layout.render(text, mark) == expected
+        assert layout.next_mark(text, mark) == expected[1]
+        if expected[1] <= mark:
+            break
+        mark = expected[1]
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice('字字字字字ab\n') for _ in range(length))
+
+
+@pytest.mark.parametrize('line_size, text_line', [(1, 1), (3, 2), (5, 4), (33, 20)])
+def test_paragraphs(line_size, text_line):
+    text = "第一章\n\n\n" + "这是一个段落。" * 20 + "\n短行\n\n" + "又一段" * 11 + "\n"
+    paginate(text, line_size, text_line)
+
+
+@pytest.mark.parametrize('line_size, text_line', [(3, 2), (33, 20)])
+def test_single_line(line_size, text_line):
+    paginate("没有换行的一整行" * 500, line_size, text_line)
+    paginate("没有换行的一整行" * 500 + "\n", line_size, text_line)
+
+
+def test_newlines_only():
+    paginate("\n\n\n", 5, 3)
+    paginate("\n字\n\n字", 1, 1)
+
+
+def test_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        text = random_text(rng, rng.randint(0, 80))
+        paginate(text, rng.randint(1, 8), rng.randint(1, 5))
+
+
+def test_page_start():
+    rng = random.Random(1)
+    for _ in range(500):
+        text = random_text(rng, rng.randint(1, 200))
+        layout = TextLayout(rng.randint(1, 6), rng.randint(1, 4))
+        offset = rng.randint(0, len(text) - 1)
+        start = layout.page_start(text, offset)
+        nextMark = layout.next_mark(text, start)
+        assert start <= offset
+        # 包含 offset，或者 offset 位于末尾只有换行符的空页中
+        assert offset < nextMark or layout.next_mark(text, nextMark) <= nextMark
@@ -0,0 +1,169 @@
+import codecs
+import os
+from typing import List, Tuple
+
+import perf
+
+# 解码与换行规范化方式发生变化时递增，使依赖字符偏移的缓存失效
+NORMALIZE_VERSION = 2
+
+# 检测编码时在文件头、中、尾各采样的字节数
+SAMPLE_SIZE = 64 * 1024
+
+# UTF-32 LE 的 BOM 以 UTF-16 LE 的 BOM 开头，必须排在前面
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 中文候选编码，按优先级排列
+_CJK_ENCODINGS = ['gbk', 'gb18030', 'big5']
+
+# 简体与繁体中文里最常用的字，用于给候选编码打分
+_COMMON_CHARS = frozenset(
+    '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发'
+    '后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开'
+    '但因只从想实日军者意无力它与长把机十民第公此已工使情明性知全三又关点正业外将两高间由问很最重并'
+    '這個們來為國說時會對於著後裡種經麼學現當沒動還進樣開從實軍無長機與點業將兩間問'
+    '，。！？、：；“”‘’（）《》…—'
+)
+
+
+def _align(sample: bytes, encoding: str) -> bytes:
+    """将从文件中间截取的样本对齐到字符边界，避免从多字节字符的中间开始
+
+    有换行时对齐到换行之后。没有换行时，UTF-8 跳过开头的后续字节 (0x80-0xBF)；
+    GBK 与 Big5 的尾字节都不小于 0x40，跳到第一个小于 0x40 的字节之后。
+    """
+    newline = sample.find(b'\n')
+    if newline != -1:
+        return sample[newline + 1:]
+    if encoding == 'utf-8':
+        i = 0
+        while i < 3 and i < len(sample) and 0x80 <= sample[i] <= 0xBF:
+            i += 1
+        return sample[i:]
+    for i, byte in enumerate(sample):
+        if byte < 0x40:
+            return sample[i + 1:]
+    return sample
+
+
+def read_samples(path: str) -> List[bytes]:
+    """读取文件头、中、尾三段样本，小文件直接返回全部内容
+
+    中、尾两段未对齐，按候选编码检查前先经过 aligned 对齐。
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_SIZE * 3:
+            return [f.read()]
+        samples = [f.read(SAMPLE_SIZE)]
+        for start in ((size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+            f.seek(start)
+            samples.append(f.read(SAMPLE_SIZE))
+    return samples
+
+
+def aligned(samples: List[bytes], encoding: str) -> List[bytes]:
+    """按编码对齐 read_samples 返回的中、尾两段样本，文件头的样本保持不变"""
+    return samples[:1] + [_align(sample, encoding) for sample in samples[1:]]
+
+
+def _is_utf8(samples: List[bytes]) -> bool:
+    last = len(samples) - 1
+    for i, sample in enumerate(samples):
+        # 只有文件末尾的样本要求以完整字符结束
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            decoder.decode(sample, final=i == last)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+def _score(samples: List[bytes], encoding: str) -> float:
+    """常用字占中文字符的比例，解码错误会大幅降低分数"""
+    common = 0
+    cjk = 0
+    errors = 0
+    for sample in samples:
+        # 样本末尾可能截断了多字节字符，忽略最后几个字节
+        text = sample[:-2].decode(encoding, errors='replace')
+        errors += text.count('\ufffd')
+        for char in text:
+            if char >= '\u3000':
+                cjk += 1
+                if char in _COMMON_CHARS:
+                    common += 1
+    if cjk == 0:
+        return 0.0
+    return (common - errors * 20) / cjk
+
+
+def detect_encoding(path: str) -> List[str]:
+    """检测文件编码
+
+    依次检查 BOM、纯 ASCII 和 UTF-8，都不满足时对中文编码按常用字比例打分，
+    没有合适的中文编码时按西文处理。只读取头、中、尾三段样本。
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        按可能性从高到低排列的编码列表，第一个即检测结果
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return [encoding]
+
+    samples = read_samples(path)
+    if all(sample.isascii() for sample in samples) or _is_utf8(aligned(samples, 'utf-8')):
+        return ['utf-8', 'gbk', 'big5', 'cp1252', 'latin-1']
+
+    scores = sorted(((_score(aligned(samples, encoding), encoding), encoding) for encoding in _CJK_ENCODINGS),
+                    reverse=True)
+    candidates = [encoding for score, encoding in scores if score > 0.05]
+    # 样本已经排除了 UTF-8
+    return candidates + ['cp1252', 'latin-1']
+
+
+def normalize(text: str) -> str:
+    """与文本模式读取相同的换行规范化，\\r\\n 和 \\r 都转换为 \\n"""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def decode_file(path: str, encodings: List[str]) -> Tuple[str, str]:
+    """读取并解码整个文件，正常情况下只用第一个编码解码一次
+
+    Returns:
+        (规范化后的文本, 实际使用的编码)
+    """
+    with perf.span('read'):
+        with open(path, 'rb') as f:
+            data = f.read()
+    with perf.span('decode'):
+        for encoding in encodings:
+            try:
+                text = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            encoding = encodings[0]
+            text = data.decode(encoding, errors='replace')
+    with perf.span('normalize'):
+        return normalize(text), encoding
+
+
+def is_ascii_compatible(encoding: str) -> bool:
+    """编码是否兼容 ASCII，换行符在其中总是单字节的 \\n"""
+    return codecs.lookup(encoding).name not in ('utf-16', 'utf-16-le', 'utf-16-be',
+                                                'utf-32', 'utf-32-le', 'utf-32-be')
@@ -1,89 +1,245 @@
-from PySide6.QtGui import QFont, QMouseEvent, QTextCursor
-from PySide6.QtWidgets import QTextEdit, QApplication
-from filecache import FileCache
+from bisect import bisect_right
+from collections import OrderedDict
 
+from PySide6.QtCore import Qt, QPointF, Signal
+from PySide6.QtGui import QColor, QFont, QFontMetricsF, QMouseEvent, QPainter
+from PySide6.QtWidgets import QAbstractScrollArea
+from filecache import contentCache
+from textlayout import layout_page_width, width_table
 
-class TextContent(QTextEdit):
-    def __init__(self, fileName, config):
+# 超长的行按该字数切成多个块分别排版，块边界是换行符和该字数的整数倍位置
+BLOCK_LIMIT = 4096
+# 滚动条的最大值，超长文本按比例换算
+SCROLL_RANGE = 2 ** 31 - 1
+
+
+class TextContent(QAbstractScrollArea):
+    # 双击某一行或按回车时发出该行的字符位置
+    offsetActivated = Signal(int)
+
+    def __init__(self, fileName, font):
+        """只排版可见区域的文本视图
+
+        文本按换行符分成块，只对窗口内可见的块及附近少量块按字符实际宽度折行，
+        滚动条的值直接对应字符偏移，打开任意大小的书都不需要排版全文。
+        """
         super().__init__()
-        print(f"[DEBUG] 初始化 TextContent，文件名：{fileName}")
-        self.file_cache = FileCache()
-        self.initText(fileName, config)
-
-    def initText(self, fileName, config):
-        print(f"[DEBUG] 开始初始化文本内容")
-        # 重置文档状态
-        print("[DEBUG] 清理文档状态")
-        self.clear()
-        self.document().clear()
-        self.document().clearUndoRedoStacks()
-
-        # 设置字体大小
-        font = QFont()
-        font.setPointSize(int(config.get('settings', 'fontSize')))
+        self.margin = 10
+        # 块起始偏移 -> (各行文本, 各行相对块起始的偏移)，只保留最近使用的块
+        self.layouts = OrderedDict()
+        self.maxLayouts = 256
+        # 顶部显示的块起始偏移，以及该块被滚出顶部的像素数
+        self.topBlock = 0
+        self.topPixel = 0.0
+        self.text = ''
+        self.viewport().setCursor(Qt.CursorShape.ArrowCursor)
+        self.initText(fileName, font)
+
+    def initText(self, fileName, font):
+        # 使用阅读窗口的字体
+        font = QFont(font)
         self.setFont(font)
-
-        # 设置背景色和文本颜色
-        self.setStyleSheet('QTextEdit { background-color: white; color: black; padding: 10px; line-height: 150%; }')
-        # 设置为只读模式
-        self.setReadOnly(True)
-
-        # 尝试从缓存获取文本
-        print(f"[DEBUG] 尝试从缓存获取文本：{fileName}")
-        content = self.file_cache.get_cached_content(fileName)
-        if content is None:
-            print("[DEBUG] 缓存未命中，开始缓存文件")
-            # 如果缓存中不存在，则缓存文件并读取
-            self.file_cache.cache_file(fileName)
-            content = self.file_cache.get_cached_content(fileName)
-
-        if content:
-            print(f"[DEBUG] 获取到文本内容，长度：{len(content)}")
-            # 分段加载文本内容
-            self.loadTextInChunks(content)
+        metrics = QFontMetricsF(font)
+        self.widths = width_table(font.key(), metrics.horizontalAdvance)
+        self.ascent = metrics.ascent()
+
+        # 设置背景色
+        self.setStyleSheet('QAbstractScrollArea { background-color: white; }')
+
+        try:
+            # 与阅读窗口共用已解码的内容
+            self.text = contentCache.load(fileName).text
+        except OSError:
+            self.text = "无法读取文件内容"
+        self.layouts.clear()
+        self.topBlock = 0
+        self.topPixel = 0.0
+        self.updateScrollBar()
+        self.viewport().update()
+
+    def blockEnd(self, start):
+        """获取从 start 开始的块的结束位置（不含换行符）"""
+        limit = (start // BLOCK_LIMIT + 1) * BLOCK_LIMIT
+        newline = self.text.find('\n', start, limit)
+        return min(newline if newline != -1 else len(self.text), limit)
+
+    def nextBlock(self, start):
+        """获取下一块的起始位置，没有时返回 None"""
+        end = self.blockEnd(start)
+        if end >= len(self.text):
+            return None
+        return end + 1 if self.text[end] == '\n' else end
+
+    def blockStart(self, pos):
+        """获取包含字符位置 pos 的块的起始位置"""
+        if pos <= 0:
+            return 0
+        if self.text[pos - 1] == '\n':
+            return pos
+        lower = pos // BLOCK_LIMIT * BLOCK_LIMIT
+        newline = self.text.rfind('\n', lower, pos)
+        if newline != -1:
+            return newline + 1
+        # 紧跟在截断处的换行符和全文末尾属于前一块
+        if lower == pos and (pos >= len(self.text) or self.text[pos] == '\n'):
+            return self.blockStart(pos - 1)
+        return lower
+
+    def previousBlock(self, start):
+        """获取上一块的起始位置，没有时返回 None"""
+        if start <= 0:
+            return None
+        # 上一块包含 start 前面的字符，以换行符结束或者在 BLOCK_LIMIT 的整数倍处被截断
+        return self.blockStart(start - 1)
+
+    def lineSpacing(self):
+        # 相当于 150% 行高
+        return QFontMetricsF(self.font()).height() * 1.5
+
+    def layoutBlock(self, start):
+        """按当前宽度折行一块文本，返回 (各行文本, 各行相对块起始的偏移)"""
+        cached = self.layouts.get(start)
+        if cached is not None:
+            self.layouts.move_to_end(start)
+            return cached
+        text = self.text[start:self.blockEnd(start)]
+        width = max(1, self.viewport().width() - self.margin * 2)
+        pieces = []
+        layout_page_width(text, 0, width, len(text) + 1, self.widths, 64, pieces)
+        lines = ''.join(pieces).split('\n') if text else ['']
+        starts = []
+        pos = 0
+        for line in lines:
+            starts.append(pos)
+            pos += len(line)
+        cached = (lines, starts)
+        self.layouts[start] = cached
+        if len(self.layouts) > self.maxLayouts:
+            self.layouts.popitem(last=False)
+        return cached
+
+    def blockHeight(self, start):
+        return len(self.layoutBlock(start)[0]) * self.lineSpacing()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.setFont(self.font())
+        painter.setPen(QColor(0, 0, 0))
+        height = self.viewport().height()
+        spacing = self.lineSpacing()
+        y = self.margin - self.topPixel
+        start = self.topBlock
+        while start is not None and y < height:
+            lines, _ = self.layoutBlock(start)
+            for line in lines:
+                if y + spacing > 0 and line:
+                    painter.drawText(QPointF(self.margin, y + self.ascent), line)
+                y += spacing
+            start = self.nextBlock(start)
+
+    def scrollByPixels(self, dy):
+        """按像素滚动，只排版经过的块"""
+        self.topPixel += dy
+        while self.topPixel < 0:
+            previous = self.previousBlock(self.topBlock)
+            if previous is None:
+                self.topPixel = 0.0
+                break
+            self.topBlock = previous
+            self.topPixel += self.blockHeight(previous)
+        while True:
+            blockHeight = self.blockHeight(self.topBlock)
+            if self.topPixel < blockHeight:
+                break
+            following = self.nextBlock(self.topBlock)
+            if following is None:
+                self.topPixel = blockHeight - self.lineSpacing()
+                break
+            self.topPixel -= blockHeight
+            self.topBlock = following
+        self.updateScrollBar()
+        self.viewport().update()
+
+    def scrollToOffset(self, offset):
+        """滚动到字符位置 offset 所在的行"""
+        offset = max(0, min(offset, len(self.text)))
+        self.topBlock = self.blockStart(offset)
+        _, starts = self.layoutBlock(self.topBlock)
+        # offset 所在的行
+        row = bisect_right(starts, offset - self.topBlock) - 1
+        self.topPixel = max(row, 0) * self.lineSpacing()
+        self.viewport().update()
+
+    def offsetAt(self, y):
+        """视口中纵坐标 y 处的行的字符位置"""
+        row = int((y - self.margin + self.topPixel) // self.lineSpacing())
+        start = self.topBlock
+        while True:
+            _, starts = self.layoutBlock(start)
+            if row < len(starts):
+                return start + starts[max(row, 0)]
+            row -= len(starts)
+            following = self.nextBlock(start)
+            if following is None:
+                return start + starts[-1]
+            start = following
+
+    def topOffset(self):
+        """顶部可见行的字符位置"""
+        _, starts = self.layoutBlock(self.topBlock)
+        row = min(int(self.topPixel // self.lineSpacing()), len(starts) - 1)
+        return self.topBlock + starts[row]
+
+    def scrollScale(self):
+        return max(1, -(-len(self.text) // SCROLL_RANGE))
+
+    def updateScrollBar(self):
+        """按顶部的字符位置更新滚动条，不触发滚动"""
+        bar = self.verticalScrollBar()
+        scale = self.scrollScale()
+        bar.blockSignals(True)
+        bar.setRange(0, len(self.text) // scale)
+        bar.setPageStep(max(1, self.viewport().height() // 20))
+        bar.setValue(self.topOffset() // scale)
+        bar.blockSignals(False)
+
+    def scrollContentsBy(self, dx, dy):
+        # 拖动滚动条时按字符位置跳转
+        self.scrollToOffset(self.verticalScrollBar().value() * self.scrollScale())
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        self.scrollByPixels(-steps * 3 * self.lineSpacing())
+
+    def keyPressEvent(self, event):
+        page = self.viewport().height() - self.lineSpacing()
+        key = event.key()
+        if key == Qt.Key.Key_Down:
+            self.scrollByPixels(self.lineSpacing())
+        elif key == Qt.Key.Key_Up:
+            self.scrollByPixels(-self.lineSpacing())
+        elif key in (Qt.Key.Key_PageDown, Qt.Key.Key_Space):
+            self.scrollByPixels(page)
+        elif key == Qt.Key.Key_PageUp:
+            self.scrollByPixels(-page)
+        elif key == Qt.Key.Key_Home:
+            self.scrollToOffset(0)
+            self.updateScrollBar()
+        elif key == Qt.Key.Key_End:
+            self.scrollToOffset(len(self.text))
+            self.updateScrollBar()
+        elif key in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+            self.offsetActivated.emit(self.topOffset())
         else:
-            print("[DEBUG] 无法读取文件内容")
-            self.setPlainText("无法读取文件内容")
-
-    def loadTextInChunks(self, content: str, chunk_size: int = 5000):
-        print("[DEBUG] 开始分段加载文本内容")
-        # 确保完全清空当前文本
-        self.clear()
-        self.document().clear()
-
-        cursor = self.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.Start)
-
-        # 分段处理文本
-        start = 0
-        chunk_count = 0
-        while start < len(content):
-            # 获取当前段的文本
-            chunk = content[start:start + chunk_size]
-
-            # 确保在完整的段落处分割
-            if start + chunk_size < len(content):
-                last_newline = chunk.rfind('\n')
-                if last_newline != -1:
-                    chunk = chunk[:last_newline + 1]
-                    start += last_newline + 1
-                else:
-                    start += chunk_size
-            else:
-                start += len(chunk)
-
-            # 插入文本段
-            cursor.insertText(chunk)
-            chunk_count += 1
-            print(f"[DEBUG] 已加载第 {chunk_count} 段文本，当前位置：{start}/{len(content)}")
-
-            # 处理事件循环，避免界面卡顿
-            QApplication.processEvents()
-
-        print("[DEBUG] 文本加载完成，移动光标到开始位置")
-        # 将光标移动到开始位置
-        cursor.movePosition(QTextCursor.MoveOperation.Start)
-        self.setTextCursor(cursor)
+            super().keyPressEvent(event)
+
+    def resizeEvent(self, event):
+        # 宽度变化后重新排版，保持顶部可见行不变
+        offset = self.topOffset()
+        self.layouts.clear()
+        super().resizeEvent(event)
+        self.scrollToOffset(offset)
+        self.updateScrollBar()
 
     # 重写点击事件
     def mousePressEvent(self, event: QMouseEvent) -> None:
@@ -95,5 +251,5 @@ class TextContent(QTextEdit):
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
         event.ignore()
 
-    def __del__(self):
-        print("[DEBUG] TextContent 被销毁")
+    def mouseDoubleClickEvent(self, event: QMouseEvent) -> None:
+        self.offsetActivated.emit(self.offsetAt(event.position().y()))
@@ -0,0 +1,315 @@
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 不能出现在行首的标点（避头）
+NO_LINE_START = frozenset('，。、；：？！）」』》〉】〕〗”’…—～·％,.;:?!)]}%')
+# 不能出现在行尾的标点（避尾）
+NO_LINE_END = frozenset('（「『《〈【〔〖“‘([{')
+# 避头尾时最多向前移动的字数，超过时保留原折行位置
+MAX_PUSH_BACK = 3
+
+
+def layout_page(text: str, mark: int, line_size: int, text_line: int,
+                pieces: Optional[List[str]] = None) -> int:
+    """从 mark 开始排版一页文本
+
+    按段落切片处理：用 str.find 在本页剩余能容纳的范围内定位换行符，段内的折行位置直接按
+    line_size 计算，连续的多个换行符合并为一个换行。结果与逐字符排版完全一致，
+    耗时只与一页的长度有关，与段落长度无关。
+
+    Args:
+        text: 全文
+        mark: 页起始偏移
+        line_size: 每行字数
+        text_line: 每页行数
+        pieces: 若提供，则按顺序追加本页显示的文本片段（含折行产生的换行符）
+
+    Returns:
+        下一页的起始偏移
+    """
+    n = len(text)
+    find = text.find
+    count = 0
+    line = 0
+    i = mark
+    while i < n:
+        # 本页剩余能容纳的字数，只在这个范围内查找换行符，更远的换行符不影响本页
+        fill = (text_line - line) * line_size - count
+        j = find('\n', i, i + fill)
+        if j == -1:
+            end = i + fill
+            if end <= n:
+                # 在段内写满一页
+                if pieces is not None:
+                    _append_wrapped(pieces, text, i, end, line_size - count, line_size)
+                return end
+            # 最后一段放不满一页
+            if pieces is not None:
+                _append_wrapped(pieces, text, i, n, line_size - count, line_size)
+            return n
+        if j > i:
+            if pieces is not None:
+                _append_wrapped(pieces, text, i, j, line_size - count, line_size)
+            # 放不满本页，只累计折行数
+            line += (count + j - i) // line_size
+        # 跳过连续的换行符，只保留最后一个
+        k = j + 1
+        while k < n and text[k] == '\n':
+            k += 1
+        if pieces is not None:
+            pieces.append('\n')
+        if k >= n:
+            # 最后一个字符是换行符，停在该换行符上
+            return n - 1
+        count = 0
+        line += 1
+        if line >= text_line:
+            return k
+        i = k
+    return i
+
+
+def _append_wrapped(pieces: List[str], text: str, start: int, end: int, first: int, line_size: int) -> None:
+    """将 [start, end) 按折行位置切片追加到 pieces，first 为第一行剩余的字数"""
+    if end - start < first:
+        pieces.append(text[start:end])
+        return
+    p = start + first
+    pieces.append(text[start:p])
+    pieces.append('\n')
+    while p + line_size <= end:
+        pieces.append(text[p:p + line_size])
+        pieces.append('\n')
+        p += line_size
+    if p < end:
+        pieces.append(text[p:end])
+
+
+class WidthTable(dict):
+    def __init__(self, measure: Callable[[str], float]):
+        """字符到显示宽度的对照表，未出现过的字符在第一次查询时测量并记录
+
+        排版时只需查表，测量只发生在每个字符第一次出现时。后台分页线程与界面线程共用，
+        测量时加锁。
+
+        Args:
+            measure: 测量单个字符宽度的函数，通常为 QFontMetricsF.horizontalAdvance
+        """
+        super().__init__()
+        self.measure = measure
+        self.lock = threading.Lock()
+
+    def __missing__(self, char: str) -> float:
+        with self.lock:
+            width = self.measure(char)
+        self[char] = width
+        return width
+
+
+# 字体标识 -> 字宽表，同一字体在多次排版之间共用
+_width_tables: Dict[str, WidthTable] = {}
+
+
+def width_table(font_key: str, measure: Callable[[str], float]) -> WidthTable:
+    """获取指定字体的字宽表，不存在时创建"""
+    table = _width_tables.get(font_key)
+    if table is None:
+        table = _width_tables[font_key] = WidthTable(measure)
+    return table
+
+
+def _push_back(text: str, start: int, brk: int) -> int:
+    """避头尾：把折行位置向前移动，让行首的标点或行尾的开括号与相邻的字一起换行"""
+    pos = brk
+    for _ in range(MAX_PUSH_BACK):
+        if pos - 1 <= start:
+            break
+        if text[pos] in NO_LINE_START or text[pos - 1] in NO_LINE_END:
+            pos -= 1
+        else:
+            return pos
+    return brk
+
+
+def layout_page_width(text: str, mark: int, width: float, text_line: int, widths: WidthTable, cap: int,
+                      pieces: Optional[List[str]] = None) -> int:
+    """按字符实际宽度从 mark 开始排版一页
+
+    换行符的处理与 layout_page 相同。段内先用 accumulate 一次算出累计宽度，
+    每行的折行位置用二分查找确定，再按避头尾规则调整。
+
+    Args:
+        text: 全文
+        mark: 页起始偏移
+        width: 每行宽度
+        text_line: 每页行数
+        widths: 字宽表
+        cap: 每行的估计字数，决定每次测量的长度
+        pieces: 若提供，则按顺序追加本页显示的文本片段（含折行产生的换行符）
+
+    Returns:
+        下一页的起始偏移
+    """
+    n = len(text)
+    line = 0
+    i = mark
+    measure = widths.__getitem__
+    while i < n:
+        # 先只在本页估计能容纳的范围内查找换行符，没有找到时 j 只是暂定的段落结尾，
+        # 排版到 j 仍未写满一页时再向后加倍查找
+        span = (text_line - line) * cap
+        j = text.find('\n', i, i + span)
+        closed = j != -1 or i + span >= n
+        if j == -1:
+            j = min(n, i + span)
+        p = i
+        # cumulative[k] 为 text[base:base + k + 1] 的总宽度，只测量本页可能用到的部分
+        base = stop = p
+        cumulative = []
+        before = 0.0
+        while p < j:
+            while stop < j and bisect_right(cumulative, before + width, p - base) >= len(cumulative):
+                # 已测量的部分不足一行，从 p 开始重新测量，仍然不足时加倍
+                stop = min(j, p + max((text_line - line) * cap, (stop - p) * 2))
+                cumulative = list(accumulate(map(measure, text[p:stop])))
+                base = p
+                before = 0.0
+            end = base + bisect_right(cumulative, before + width, p - base)
+            if end >= j and not closed:
+                # 剩余部分放得下，段落可能还没有结束，继续查找换行符
+                found = text.find('\n', j, i + span * 2)
+                closed = found != -1 or i + span * 2 >= n
+                j = found if found != -1 else min(n, i + span * 2)
+                span *= 2
+                continue
+            if end >= j:
+                if pieces is not None:
+                    pieces.append(text[p:j])
+                break
+            # 每行至少放一个字符
+            brk = _push_back(text, p, max(end, p + 1))
+            if pieces is not None:
+                pieces.append(text[p:brk])
+                pieces.append('\n')
+            line += 1
+            if line >= text_line:
+                return brk
+            before = cumulative[brk - base - 1]
+            p = brk
+        if j >= n:
+            return n
+        # 跳过连续的换行符，只保留最后一个
+        k = j + 1
+        while k < n and text[k] == '\n':
+            k += 1
+        if pieces is not None:
+            pieces.append('\n')
+        if k >= n:
+            return n - 1
+        line += 1
+        if line >= text_line:
+            return k
+        i = k
+    return i
+
+
+class TextLayout:
+    def __init__(self, line_size: int, text_line: int):
+        """按固定字数折行的排版引擎
+
+        Args:
+            line_size: 每行字数
+            text_line: 每页行数
+        """
+        self.line_size = max(1, line_size)
+        self.text_line = max(1, text_line)
+
+    @property
+    def key(self) -> str:
+        """排版参数的标识，用于分页缓存"""
+        return f"chars:{self.line_size}x{self.text_line}"
+
+    def layout_page(self, text: str, mark: int, pieces: Optional[List[str]] = None) -> int:
+        """从 mark 开始排版一页，返回下一页的起始偏移"""
+        return layout_page(text, mark, self.line_size, self.text_line, pieces)
+
+    def next_mark(self, text: str, mark: int) -> int:
+        """获取从 mark 开始的一页之后的下一页起始偏移"""
+        return self.layout_page(text, mark)
+
+    def previous_mark(self, text: str, mark: int) -> int:
+        """不依赖全书索引，只在 mark 之前局部排版，返回上一页的起始偏移
+
+        从 mark 之前约两页处的段落开头开始向后排版，取最后一个在 mark 之前开始的页。
+        段落过长时直接从两页之前开始，此时的折行位置可能与从头排版略有不同。
+        """
+        if mark <= 0:
+            return 0
+        span = self.line_size * self.text_line
+        limit = max(0, mark - span * 2)
+        start = 0
+        if limit > 0:
+            found = text.rfind('\n', max(0, limit - span * 4), limit)
+            start = found + 1 if found != -1 else limit
+        while True:
+            nextMark = self.layout_page(text, start)
+            if nextMark >= mark or nextMark <= start:
+                return start
+            start = nextMark
+
+    def page_start(self, text: str, offset: int) -> int:
+        """不依赖全书索引，获取一个包含 offset 的页的起始偏移
+
+        offset 所在段落的开头在一页以内时从段落开头开始向后排版，否则按 previous_mark 局部排版。
+        得到的页首不一定与全书索引对齐。
+        """
+        offset = min(max(offset, 0), max(len(text) - 1, 0))
+        span = self.line_size * self.text_line
+        start = text.rfind('\n', max(0, offset - span), offset) + 1
+        if start == 0 and offset > span:
+            return self.previous_mark(text, offset + 1)
+        while True:
+            nextMark = self.layout_page(text, start)
+            # 下一页为空（只剩末尾的换行符）时停在当前页
+            if nextMark > offset or nextMark <= start or self.layout_page(text, nextMark) <= nextMark:
+                return start
+            start = nextMark
+
+    def render(self, text: str, mark: int) -> Tuple[str, int]:
+        """排版一页并生成显示用的文本，返回 (页文本, 下一页的起始偏移)"""
+        pieces = []
+        nextMark = self.layout_page(text, mark, pieces)
+        return ''.join(pieces), nextMark
+
+
+class GlyphLayout(TextLayout):
+    # 避头尾规则变化时递增，使分页缓存失效
+    RULES_VERSION = 1
+
+    def __init__(self, font_key: str, widths: WidthTable, width: float, text_line: int):
+        """按字符实际宽度折行的排版引擎
+
+        西文和半角标点按实际宽度计算，一行能放下更多字符，并遵守中文避头尾规则。
+
+        Args:
+            font_key: 字体标识，用于分页缓存
+            widths: 该字体的字宽表
+            width: 每行宽度
+            text_line: 每页行数
+        """
+        self.font_key = font_key
+        self.widths = widths
+        self.width = width
+        # 按全角字宽估算每行字数，供局部排版和每次测量的初始长度使用
+        fullWidth = max(widths['中'], 1)
+        super().__init__(max(1, int(width // fullWidth)), text_line)
+        self.cap = self.line_size + 4
+
+    @property
+    def key(self) -> str:
+        return f"glyph:{self.font_key}:{self.width:g}x{self.text_line}:{self.RULES_VERSION}"
+
+    def layout_page(self, text: str, mark: int, pieces: Optional[List[str]] = None) -> int:
+        return layout_page_width(text, mark, self.width, self.text_line, self.widths, self.cap, pieces)